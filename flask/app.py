@@ -1,20 +1,234 @@
 #!/usr/bin/python3
 # -*- coding=utf-8 -*-
+import asyncio
+import contextvars
+import inspect
+import sys
+import zlib
+from functools import partial
+from io import BytesIO
 from threading import Lock
 
+from flask.templating import TemplateBytecodeCache
+
+
+def _make_compressor(encoding, level):
+    # wbits 31 生成 gzip 格式，15 生成 HTTP 的 deflate（zlib 格式）
+    return zlib.compressobj(level, zlib.DEFLATED,
+                            encoding == 'gzip' and 31 or 15)
+
+
+def _compress_chunks(chunks, encoding, level):
+    """Compresses a streamed body incrementally.  Every chunk the
+    application yields is sync flushed, so each one reaches the client as
+    soon as it's produced, like the rows of an NDJSON stream.  An empty
+    chunk, the flush hint of streaming responses, is passed on.
+    """
+    compressor = _make_compressor(encoding, level)
+    for data in chunks:
+        if data:
+            yield compressor.compress(data) + \
+                compressor.flush(zlib.Z_SYNC_FLUSH)
+        else:
+            yield b''
+    yield compressor.flush()
+
+
+def _environ_from_scope(scope, body):
+    """Builds a WSGI environment for an ASGI ``http`` scope so the
+    request object and the URL adapter work the same as for WSGI.
+    """
+    server = scope.get('server') or ('localhost', 80)
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'asgi.scope': scope,
+    }
+    client = scope.get('client')
+    if client:
+        environ['REMOTE_ADDR'] = client[0]
+        environ['REMOTE_PORT'] = str(client[1])
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin1')
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+    return environ
+
+
+class _RequestPipeline(object):
+    """The request hooks that apply to one blueprint (or to requests
+    outside of blueprints if the name is `None`), flattened into tuples in
+    the order :meth:`Flask.preprocess_request` and
+    :meth:`Flask.process_response` call them.
+    """
+    __slots__ = ('url_value_preprocessors', 'before_request_funcs',
+                 'after_request_funcs')
+
+    def __init__(self, app, bp):
+        def collect(funcs):
+            rv = list(funcs.get(None, ()))
+            if bp is not None:
+                rv.extend(funcs.get(bp, ()))
+            return tuple(rv)
+        self.url_value_preprocessors = collect(app.url_value_preprocessors)
+        self.before_request_funcs = collect(app.before_request_funcs)
+        after = []
+        if bp is not None:
+            after.extend(reversed(app.after_request_funcs.get(bp, ())))
+        after.extend(reversed(app.after_request_funcs.get(None, ())))
+        self.after_request_funcs = tuple(after)
+
+
 class Flask(_PackageBoundObject):
+
+    #: Default configuration parameters.
+    default_config = ImmutableDict({
+        'DEBUG':                                get_debug_flag(default=False),
+        'TESTING':                              False,
+        'PROPAGATE_EXCEPTIONS':                 None,
+        'PRESERVE_CONTEXT_ON_EXCEPTION':        None,
+        'SECRET_KEY':                           None,
+        'PERMANENT_SESSION_LIFETIME':           timedelta(days=31),
+        'USE_X_SENDFILE':                       False,
+        'LOGGER_NAME':                          None,
+        'LOGGER_HANDLER_POLICY':               'always',
+        'SERVER_NAME':                          None,
+        'APPLICATION_ROOT':                     None,
+        'SESSION_COOKIE_NAME':                  'session',
+        'SESSION_COOKIE_DOMAIN':                None,
+        'SESSION_COOKIE_PATH':                  None,
+        'SESSION_COOKIE_HTTPONLY':              True,
+        'SESSION_COOKIE_SECURE':                False,
+        'SESSION_REFRESH_EACH_REQUEST':         True,
+        'MAX_CONTENT_LENGTH':                   None,
+        'SEND_FILE_MAX_AGE_DEFAULT':            timedelta(hours=12),
+        'TRAP_BAD_REQUEST_ERRORS':              False,
+        'TRAP_HTTP_EXCEPTIONS':                 False,
+        'EXPLAIN_TEMPLATE_LOADING':             False,
+        'PREFERRED_URL_SCHEME':                 'http',
+        'JSON_AS_ASCII':                        True,
+        'JSON_SORT_KEYS':                       True,
+        'JSONIFY_PRETTYPRINT_REGULAR':          False,
+        'JSONIFY_MIMETYPE':                     'application/json',
+        'TEMPLATES_AUTO_RELOAD':                None,
+        'LAZY_ROUTING':                         False,
+        'STATIC_PRECOMPRESSED':                 False,
+        'COMPRESS_RESPONSES':                   False,
+        'COMPRESS_MIN_SIZE':                    500,
+        'COMPRESS_LEVEL':                       6,
+        'TEMPLATE_BYTECODE_CACHE':              False,
+    })
+
+    #: If enabled the request context does not bind the URL adapter and
+    #: match the URL when it's created.  Both happen the first time
+    #: :attr:`~flask.Request.url_rule`, :attr:`~flask.Request.view_args`
+    #: or :attr:`~flask.Request.routing_exception` is needed, usually in
+    #: :meth:`dispatch_request`.  Requests rejected by a
+    #: :meth:`before_request` function never pay for the routing.
+    #:
+    #: This attribute can also be configured from the config with the
+    #: ``LAZY_ROUTING`` configuration key.  Defaults to ``False``.
+    lazy_routing = ConfigAttribute('LAZY_ROUTING')
+
+    #: The maximum number of bound URL adapters :meth:`create_url_adapter`
+    #: keeps.  Most deployments serve one or two hosts, the limit only
+    #: protects against clients sending many different ``Host`` headers.
+    url_adapter_cache_size = 64
+
+    #: Mimetypes :meth:`compress_response` leaves alone because the data
+    #: is compressed already, or that are event streams whose events have
+    #: to arrive one by one.  Images, audio and video other than SVG are
+    #: skipped as well.
+    compress_skip_mimetypes = frozenset([
+        'application/gzip', 'application/x-gzip', 'application/zip',
+        'application/x-bzip2', 'application/x-xz',
+        'application/x-7z-compressed', 'application/x-rar-compressed',
+        'application/pdf',
+        'application/octet-stream', 'font/woff', 'font/woff2',
+        'application/font-woff', 'text/event-stream',
+    ])
+
+    #: The function :meth:`~flask.Request.get_json` and
+    #: :meth:`~flask.Request.iter_json` decode request bodies with, for
+    #: example ``orjson.loads``.  It's called with the body as bytes, or
+    #: as text if the request declares a charset other than UTF-8.  `None`
+    #: uses :func:`flask.json.loads` with :attr:`json_decoder`.  Set it
+    #: when the application is created.
+    json_loads = None
+
     def __init__(self, import_name, static_path=None, static_url_path=None,
                  static_folder='static', template_folder='templates',
                  instance_path=None, instance_relative_config=False,
-                 root_path=None):
+                 root_path=None, context_locals=None):
         _PackageBoundObject.__init__(self, import_name,
                                      template_folder=template_folder,
                                      root_path=root_path)
         self.view_functions = {}
         self.url_map = Map()
+
+        # 按 (host, script_name, url_scheme) 缓存绑定好的 MapAdapter，
+        # 每个请求只替换 path 和 method
+        self._url_adapters = {}
+        self._url_adapters_map = None
         
+        #: A dictionary with lists of functions that should be called at the
+        #: beginning of the request.  The key of the dictionary is the name of
+        #: the blueprint this function is active for, `None` for all requests.
+        self.before_request_funcs = {}
+
+        #: A lists of functions that should be called at the beginning of the
+        #: first request to this instance.
+        self.before_first_request_funcs = []
+
+        #: A dictionary with lists of functions that should be called after
+        #: each request.  The key of the dictionary is the name of the blueprint
+        #: this function is active for, `None` for all requests.
+        self.after_request_funcs = {}
+
+        #: A dictionary with lists of functions that are called without argument
+        #: to populate the values passed to the view.  The key of the
+        #: dictionary is the name of the blueprint this function is active
+        #: for, `None` for all requests.
+        self.url_value_preprocessors = {}
+
+        #: A dictionary of functions that convert view return values of
+        #: a certain type into a response, see
+        #: :meth:`register_response_converter`.
+        self.response_converters = {}
+
+        # make_response 按 type(rv) 查找转换函数的表，第一次遇到某类型时填充
+        self._response_converters = {}
+
+        # 按蓝图名编译好的钩子流水线，第一次请求时生成，钩子数量变化时重新生成
+        self._request_pipelines = {}
+
         self._got_first_request = False
         self._before_request_lock = Lock()
+
+        # context_locals='contextvars' 时请求/应用上下文栈改用 ContextVar 保存，
+        # 同样适用于 asyncio 任务；None 表示保持当前的实现
+        if context_locals is not None:
+            _set_context_locals(context_locals)
     
     def run(self, host=None, port=None, debug=None, **options):
         """Runs the application on a local development server.
@@ -65,6 +279,118 @@ class Flask(_PackageBoundObject):
             # 不管处理是否发生异常，都需要把栈中的请求 pop 出来
             ctx.auto_pop(error)
             
+    async def asgi_app(self, scope, receive, send):
+        """The ASGI application.  It creates the same
+        :class:`~flask.ctx.RequestContext` as :meth:`wsgi_app` from the
+        ASGI scope and awaits view functions declared with ``async def``,
+        so a view waiting on I/O doesn't hold a thread.  Serve it with any
+        ASGI server::
+
+            uvicorn yourapplication:app.asgi_app
+
+        Many requests run on the same thread here, so the application
+        must be created with ``context_locals='contextvars'``.
+        @ 每个请求在自己的 asyncio 任务里运行，上下文栈必须基于 ContextVar
+        """
+        if scope['type'] == 'lifespan':
+            return await self._asgi_lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise RuntimeError('Unsupported ASGI scope %r' % scope['type'])
+        if not isinstance(_request_ctx_stack._local, ContextVarLocal):
+            raise RuntimeError('The ASGI entry point requires the app to '
+                               'be created with context_locals='
+                               '\'contextvars\'.')
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+
+        environ = _environ_from_scope(scope, b''.join(chunks))
+        ctx = self.request_context(environ)
+        ctx.push()
+        error = None
+        try:
+            try:
+                response = await self.full_dispatch_request_async()
+            except Exception as e:
+                error = e
+                response = self.handle_exception(e)
+            await self._send_asgi_response(response, environ, send)
+        finally:
+            if self.should_ignore_error(error):
+                error = None
+            ctx.auto_pop(error)
+
+    async def _asgi_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _send_asgi_response(self, response, environ, send):
+        """Sends the response to the ASGI server.  Async iterables are
+        awaited, buffered bodies (lists and tuples) are sent directly and
+        other iterables are advanced in the default executor so a slow
+        generator doesn't block the event loop.
+        """
+        body = response.response
+        if hasattr(body, '__aiter__'):
+            status = response.status_code
+            headers = response.get_wsgi_headers(environ).to_wsgi_list()
+            app_iter = None
+        else:
+            status_headers = []
+            def start_response(status, headers, exc_info=None):
+                status_headers[:] = [status, headers]
+            app_iter = body = response(environ, start_response)
+            status = int(status_headers[0].split(None, 1)[0])
+            headers = status_headers[1]
+
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': status,
+                'headers': [(key.lower().encode('latin1'),
+                             value.encode('latin1'))
+                            for key, value in headers],
+            })
+            if hasattr(body, '__aiter__'):
+                async for data in body:
+                    if isinstance(data, text_type):
+                        data = data.encode(response.charset)
+                    await send({'type': 'http.response.body',
+                                'body': data, 'more_body': True})
+            elif response.is_sequence:
+                # 缓冲好的响应体编码和遍历都不会阻塞，直接发送，
+                # 不用每一块都交给线程池
+                for data in body:
+                    await send({'type': 'http.response.body',
+                                'body': data, 'more_body': True})
+            else:
+                loop = asyncio.get_event_loop()
+                context = contextvars.copy_context()
+                iterator = iter(body)
+                while True:
+                    data = await loop.run_in_executor(
+                        None, context.run, next, iterator, None)
+                    if data is None:
+                        break
+                    await send({'type': 'http.response.body',
+                                'body': data, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'',
+                        'more_body': False})
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
     def request_context(self, environ):
         """Creates a :class:`~flask.ctx.RequestContext` from the given
         environment and binds it to the current context.  This must be used in
@@ -96,7 +422,8 @@ class Flask(_PackageBoundObject):
         """
         self.try_trigger_before_first_request_functions()   # 进行发生真实请求前的处理 ，目的是，最后将_got_first_request属性置为True.
         try:
-            request_started.send(self)      # socket部分的操作  request_started = _signals.signal('request-started')
+            if request_started.receivers:
+                request_started.send(self)      # socket部分的操作  request_started = _signals.signal('request-started')
             rv = self.preprocess_request()  # 进行请求的预处理 ，主要是进行flask的hook钩子, before_request功能的实现，也就是在真正发生请求之前，有些事情需要提前做
             if rv is None:
                 rv = self.dispatch_request()        # 进行请求判定和分发
@@ -112,6 +439,23 @@ class Flask(_PackageBoundObject):
         @ dispatch_request 要做的就是找到我们的处理函数，并返回调用的结果，也就是路由的过程
         """
     
+    async def full_dispatch_request_async(self):
+        """Like :meth:`full_dispatch_request`, but awaits the return value
+        of the view function if it's awaitable.  Used by :meth:`asgi_app`.
+        """
+        self.try_trigger_before_first_request_functions()
+        try:
+            if request_started.receivers:
+                request_started.send(self)
+            rv = self.preprocess_request()
+            if rv is None:
+                rv = self.dispatch_request()
+                if inspect.isawaitable(rv):
+                    rv = await rv
+        except Exception as e:
+            rv = self.handle_user_exception(e)
+        return self.finalize_request(rv)
+
     def dispatch_request(self):
         """Does the request dispatching.  Matches the URL and returns the
         return value of the view or error handler.  This does not have to
@@ -136,7 +480,8 @@ class Flask(_PackageBoundObject):
         response = self.make_response(rv)
         try:
             response = self.process_response(response)  # 主要是处理一个after_request的功能，比如你在请求后，要把数据库连接关闭等动作，和上面提到的before_request对应和类似。
-            request_finished.send(self, response=response)  # request_finished = _signals.signal('request-finished')
+            if request_finished.receivers:
+                request_finished.send(self, response=response)  # request_finished = _signals.signal('request-finished')
         except Exception:
             if not from_error_handler:
                 raise
@@ -144,13 +489,161 @@ class Flask(_PackageBoundObject):
                                   'error while handling an error')
         return response
     
+    def _compile_request_pipelines(self):
+        """Builds a :class:`_RequestPipeline` for requests outside of
+        blueprints and one for every blueprint that registered hooks.
+        Blueprints without hooks of their own share the `None` pipeline.
+
+        The pipelines are compiled again whenever the number of hooks
+        changes, so hooks added to :attr:`before_request_funcs` and the
+        other dicts directly, as blueprints do when they are registered,
+        are picked up too.
+        """
+        names = set([None])
+        for funcs in (self.url_value_preprocessors, self.before_request_funcs,
+                      self.after_request_funcs):
+            names.update(funcs)
+        pipelines = dict((bp, _RequestPipeline(self, bp)) for bp in names)
+        self._request_pipelines = pipelines
+        self._request_pipelines_key = self._get_request_hooks_key()
+        return pipelines
+
+    def _get_request_hooks_key(self):
+        return tuple(len(funcs) for hooks in (self.url_value_preprocessors,
+                                              self.before_request_funcs,
+                                              self.after_request_funcs)
+                     for funcs in hooks.values())
+
+    def _get_request_pipeline(self, ctx):
+        pipelines = self._request_pipelines
+        # 钩子数量变了（包括直接修改字典的情况）就重新编译
+        if not pipelines or \
+                self._request_pipelines_key != self._get_request_hooks_key():
+            pipelines = self._compile_request_pipelines()
+        # 只有蓝图注册了自己的钩子时才需要知道当前蓝图，避免在延迟路由时提前匹配 URL
+        if len(pipelines) == 1:
+            return pipelines[None]
+        return pipelines.get(ctx.request.blueprint, pipelines[None])
+
+    def preprocess_request(self):
+        """Called before the actual request dispatching and will
+        call each :meth:`before_request` decorated function, passing no
+        arguments.
+        If any of these functions returns a value, it's handled as
+        if it was the return value from the view and further
+        request handling is stopped.
+
+        This also triggers the :meth:`url_value_preprocessor` functions before
+        the actual :meth:`before_request` functions are called.
+
+        The functions are taken from a pipeline compiled on the first
+        request, so apps without hooks only pay for two empty loops.
+        """
+        pipeline = self._get_request_pipeline(_request_ctx_stack.top)
+        if pipeline.url_value_preprocessors:
+            for func in pipeline.url_value_preprocessors:
+                func(request.endpoint, request.view_args)
+
+        for func in pipeline.before_request_funcs:
+            rv = func()
+            if rv is not None:
+                return rv
+
+    def process_response(self, response):
+        """Can be overridden in order to modify the response object
+        before it's sent to the WSGI server.  By default this will
+        call all the :meth:`after_request` decorated functions.
+        """
+        ctx = _request_ctx_stack.top
+        funcs = self._get_request_pipeline(ctx).after_request_funcs
+        if ctx._after_request_functions:
+            funcs = chain(ctx._after_request_functions, funcs)
+        for handler in funcs:
+            response = handler(response)
+        if not self.session_interface.is_null_session(ctx.session):
+            self.save_session(ctx.session, response)
+        if self.config['COMPRESS_RESPONSES']:
+            response = self.compress_response(response)
+        return response
+
+    def compress_response(self, response):
+        """Compresses the response body with the best encoding of the
+        client's ``Accept-Encoding`` (``gzip`` or ``deflate``, respecting
+        the q-values).  Called by :meth:`process_response` if
+        ``COMPRESS_RESPONSES`` is enabled.
+
+        Bodies smaller than ``COMPRESS_MIN_SIZE``, mimetypes in
+        :attr:`compress_skip_mimetypes`, responses that are encoded
+        already, passed through directly or marked ``no-transform`` are
+        left alone, and so are async iterable bodies served by
+        :meth:`asgi_app`.  Streamed bodies are compressed chunk by chunk as they
+        are sent and every chunk is flushed right away, so neither the
+        time to the first byte nor the latency of later chunks grows.
+        """
+        status = response.status_code
+        if status < 200 or status in (204, 206, 304) or \
+                request.method == 'HEAD' or response.direct_passthrough or \
+                'Content-Encoding' in response.headers or \
+                response.cache_control.no_transform or \
+                hasattr(response.response, '__aiter__'):
+            return response
+        mimetype = response.mimetype
+        if not mimetype or mimetype in self.compress_skip_mimetypes or (
+                mimetype.startswith(('image/', 'audio/', 'video/')) and
+                mimetype != 'image/svg+xml'):
+            return response
+
+        min_size = self.config['COMPRESS_MIN_SIZE']
+        if response.is_sequence:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+        else:
+            data = None
+            length = response.headers.get('Content-Length', type=int)
+            if length is not None and length < min_size:
+                return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(('gzip', 'deflate'))
+        if encoding is None:
+            return response
+
+        level = self.config['COMPRESS_LEVEL']
+        if data is not None:
+            compressor = _make_compressor(encoding, level)
+            response.set_data(compressor.compress(data) + compressor.flush())
+        else:
+            body = response.response
+            if hasattr(body, 'close'):
+                response.call_on_close(body.close)
+            response.response = _compress_chunks(response.iter_encoded(),
+                                                 encoding, level)
+            response.headers.pop('Content-Length', None)
+        response.content_encoding = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
     def make_response(self, rv):
         """Converts the return value from a view function to a real
         response object that is an instance of :attr:`response_class`.
+
+        The conversion is looked up by ``type(rv)`` in a table that is
+        filled the first time a type is seen, so the ``isinstance`` checks
+        run once per type and not once per request.  Own return types can
+        be added with :meth:`register_response_converter`.
         """
         status_or_headers = headers = None
         if isinstance(rv, tuple):
-            rv, status_or_headers, headers = rv + (None,) * (3 - len(rv))
+            len_rv = len(rv)
+            if len_rv == 2:
+                rv, status_or_headers = rv
+            elif len_rv == 3:
+                rv, status_or_headers, headers = rv
+            else:
+                rv, status_or_headers, headers = rv + (None,) * (3 - len_rv)
 
         if rv is None:
             raise ValueError('View function did not return a response')
@@ -158,36 +651,168 @@ class Flask(_PackageBoundObject):
         if isinstance(status_or_headers, (dict, list)):
             headers, status_or_headers = status_or_headers, None
 
-        if not isinstance(rv, self.response_class):
-            # When we create a response object directly, we let the constructor
-            # set the headers and status.  We do this because there can be
-            # some extra logic involved when creating these objects with
-            # specific values (like default content type selection).
-            if isinstance(rv, (text_type, bytes, bytearray)):
-                rv = self.response_class(rv, headers=headers,
-                                         status=status_or_headers)
-                headers = status_or_headers = None
+        return self._convert_response(rv, status_or_headers, headers)
+
+    def _convert_response(self, rv, status, headers):
+        # 按返回值类型分派，第一次遇到某个类型时才计算用哪个转换函数
+        converter = self._response_converters.get(type(rv))
+        if converter is None:
+            converter = self._find_response_converter(type(rv))
+        return converter(rv, status, headers)
+
+    def _find_response_converter(self, rv_type):
+        if issubclass(rv_type, self.response_class):
+            converter = self._response_from_response
+        elif issubclass(rv_type, (text_type, bytes, bytearray)):
+            converter = self._response_from_string
+        else:
+            for base in rv_type.__mro__:
+                func = self.response_converters.get(base)
+                if func is not None:
+                    converter = partial(self._response_from_converter, func)
+                    break
             else:
-                rv = self.response_class.force_type(rv, request.environ)
+                converter = self._response_from_force_type
+        self._response_converters[rv_type] = converter
+        return converter
 
-        if status_or_headers is not None:
-            if isinstance(status_or_headers, string_types):
-                rv.status = status_or_headers
+    def _response_from_response(self, rv, status, headers):
+        if status is not None:
+            if isinstance(status, string_types):
+                rv.status = status
             else:
-                rv.status_code = status_or_headers
+                rv.status_code = status
         if headers:
             rv.headers.extend(headers)
+        return rv
+
+    def _response_from_string(self, rv, status, headers):
+        # When we create a response object directly, we let the constructor
+        # set the headers and status.  We do this because there can be
+        # some extra logic involved when creating these objects with
+        # specific values (like default content type selection).
+        return self.response_class(rv, headers=headers, status=status)
+
+    def _response_from_force_type(self, rv, status, headers):
+        rv = self.response_class.force_type(rv, request.environ)
+        return self._response_from_response(rv, status, headers)
+
+    def _response_from_converter(self, func, rv, status, headers):
+        return self._convert_response(func(rv), status, headers)
 
+    @setupmethod
+    def register_response_converter(self, rv_type, f):
+        """Registers a function that converts view return values of type
+        `rv_type` (or a subclass of it) into something :meth:`make_response`
+        accepts, like a response object or a string.  For example to return
+        pre-serialised JSON blobs::
+
+            app.register_response_converter(
+                JSONBlob, lambda blob: PreEncodedResponse(blob.data))
+
+        A status and headers returned together with the value in a tuple
+        are applied afterwards.
+        """
+        self.response_converters[rv_type] = f
+        self._response_converters = {}
+
+    def create_jinja_environment(self):
+        """Creates the Jinja2 environment based on :attr:`jinja_options`
+        and :meth:`select_jinja_autoescape`.  Since 0.7 this also adds
+        the Jinja2 globals and filters after initialization.  Override
+        this function to customize the behavior.
+
+        If ``TEMPLATE_BYTECODE_CACHE`` is enabled the compiled templates
+        are kept in a :class:`~flask.templating.TemplateBytecodeCache`,
+        in the ``jinja_cache`` folder of the :attr:`instance_path` or in
+        the folder the key is set to.
+
+        .. versionadded:: 0.5
+        .. versionchanged:: 0.11
+           ``Environment.auto_reload`` set in accordance with
+           ``TEMPLATES_AUTO_RELOAD`` configuration option.
+        """
+        options = dict(self.jinja_options)
+        if 'autoescape' not in options:
+            options['autoescape'] = self.select_jinja_autoescape
+        if 'auto_reload' not in options:
+            if self.config['TEMPLATES_AUTO_RELOAD'] is not None:
+                options['auto_reload'] = self.config['TEMPLATES_AUTO_RELOAD']
+            else:
+                options['auto_reload'] = self.debug
+        cache_dir = self.config['TEMPLATE_BYTECODE_CACHE']
+        if cache_dir and 'bytecode_cache' not in options:
+            if cache_dir is True:
+                cache_dir = os.path.join(self.instance_path, 'jinja_cache')
+            options['bytecode_cache'] = TemplateBytecodeCache(cache_dir)
+        rv = self.jinja_environment(self, **options)
+        rv.globals.update(
+            url_for=url_for,
+            get_flashed_messages=get_flashed_messages,
+            config=self.config,
+            # request, session and g are normally added with the
+            # context processor for efficiency reasons but for imported
+            # templates we also want the proxies in there.
+            request=request,
+            session=session,
+            g=g
+        )
+        rv.filters['tojson'] = json.tojson_filter
         return rv
 
+    def precompile_templates(self, extensions=None, filter_func=None):
+        """Loads and compiles every template the loaders of the
+        application and its blueprints list, so the first requests don't
+        pay for it.  With ``TEMPLATE_BYTECODE_CACHE`` enabled this also
+        fills the cache for other workers.  Call it once at startup, for
+        a pre-fork server before the workers are started.  `extensions`
+        and `filter_func` select the templates like
+        :meth:`jinja2.Environment.list_templates`.  Returns the number of
+        compiled templates.
+        """
+        env = self.jinja_env
+        names = env.list_templates(extensions, filter_func)
+        for name in names:
+            env.get_template(name)
+        return len(names)
+
     def create_url_adapter(self, request):
         """Creates a URL adapter for the given request.  The URL adapter
         is created at a point where the request context is not yet set up
         so the request is passed explicitly.
+
+        Adapters bound to a request are cached per host, script name and
+        URL scheme.  Later requests to the same host get a copy of the
+        cached adapter with only the path, method and query string
+        replaced.  The cache is dropped when rules are added or
+        :attr:`url_map` is replaced.
         """
         if request is not None:
-            return self.url_map.bind_to_environ(request.environ,
-                server_name=self.config['SERVER_NAME'])
+            environ = request.environ
+            server_name = self.config['SERVER_NAME']
+            if self._url_adapters_map is not self.url_map:
+                self._url_adapters.clear()
+                self._url_adapters_map = self.url_map
+            key = (environ.get('HTTP_HOST'), environ.get('SERVER_NAME'),
+                   environ.get('SERVER_PORT'), environ.get('SCRIPT_NAME'),
+                   environ['wsgi.url_scheme'], server_name)
+            adapter = self._url_adapters.get(key)
+            if adapter is None:
+                adapter = self.url_map.bind_to_environ(
+                    environ, server_name=server_name)
+                # the host comes from the client, don't let the cache grow
+                if len(self._url_adapters) >= self.url_adapter_cache_size:
+                    self._url_adapters.clear()
+                self._url_adapters[key] = adapter
+                return adapter
+            path_info = environ.get('PATH_INFO')
+            if path_info is None:
+                path_info = '/'
+            else:
+                path_info = wsgi_decoding_dance(path_info,
+                                                self.url_map.charset)
+            return adapter.rebind(path_info, environ['REQUEST_METHOD'],
+                                  environ.get('QUERY_STRING', ''))
         # We need at the very least the server name to be set for this
         # to work.
         if self.config['SERVER_NAME'] is not None:
@@ -218,6 +843,7 @@ class Flask(_PackageBoundObject):
         rule = self.url_rule_class(rule, methods=methods, **options)
 
         self.url_map.add(rule)
+        self._url_adapters.clear()
         if view_func is not None:
             old_func = self.view_functions.get(endpoint)
             if old_func is not None and old_func != view_func:
@@ -225,6 +851,49 @@ class Flask(_PackageBoundObject):
                                      'existing endpoint function: %s' % endpoint)
             self.view_functions[endpoint] = view_func
     
+    @setupmethod
+    def before_request(self, f):
+        """Registers a function to run before each request.
+
+        The function will be called without any arguments.
+        If the function returns a non-None value, it's handled as
+        if it was the return value from the view and further
+        request handling is stopped.
+        """
+        self.before_request_funcs.setdefault(None, []).append(f)
+        self._request_pipelines = {}
+        return f
+
+    @setupmethod
+    def before_first_request(self, f):
+        """Registers a function to be run before the first request to this
+        instance of the application.
+        """
+        self.before_first_request_funcs.append(f)
+        return f
+
+    @setupmethod
+    def after_request(self, f):
+        """Register a function to be run after each request.
+
+        Your function must take one parameter, an instance of
+        :attr:`response_class` and return a new response object or the
+        same (see :meth:`process_response`).
+        """
+        self.after_request_funcs.setdefault(None, []).append(f)
+        self._request_pipelines = {}
+        return f
+
+    @setupmethod
+    def url_value_preprocessor(self, f):
+        """Registers a function as URL value preprocessor for all view
+        functions of the application.  It's called before the view functions
+        are called and can modify the url values provided.
+        """
+        self.url_value_preprocessors.setdefault(None, []).append(f)
+        self._request_pipelines = {}
+        return f
+
     def try_trigger_before_first_request_functions(self):
         """Called before each request and will ensure that it triggers
         the :attr:`before_first_request_funcs` and only exactly once per
@@ -15,10 +15,29 @@ class RequestContext(object):
         if request is None:
             request = app.request_class(environ)
         self.request = request
-        self.url_adapter = app.create_url_adapter(self.request)
+        self._url_adapter = None
+
+        if app.lazy_routing:
+            # 延迟路由：第一次用到 url_rule/view_args/routing_exception 时
+            # 才创建 URL adapter 并匹配。只保存标记，请求不引用上下文，
+            # 不会形成引用环
+            request._deferred_match = True
+        else:
+            self.url_adapter = app.create_url_adapter(self.request)
+            self.match_request()
+
+    def _get_url_adapter(self):
+        if self._url_adapter is None:
+            self._url_adapter = self.app.create_url_adapter(self.request)
+        return self._url_adapter
+    def _set_url_adapter(self, value):
+        self._url_adapter = value
+    url_adapter = property(_get_url_adapter, _set_url_adapter, doc='''
+    The URL adapter for the request.  With lazy routing it's created on
+    first access.
+    ''')
+    del _get_url_adapter, _set_url_adapter
 
-        self.match_request()
-        
     def match_request(self):
         """Can be overridden by a subclass to hook into the matching
         of the request.
@@ -27,6 +46,8 @@ class RequestContext(object):
             url_rule, self.request.view_args = \
                 self.url_adapter.match(return_rule=True)
             self.request.url_rule = url_rule
+            # 三个属性都设置在实例上，读取时不用经过 Request.__getattr__
+            self.request.routing_exception = None
         except HTTPException as e:
             self.request.routing_exception = e
             
@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 # -*- coding=utf-8 -*-
 from functools import partial
-from werkzeug.local import LocalStack, LocalProxy
+from werkzeug.local import Local, ContextVarLocal, LocalStack, LocalProxy
 
 
 _request_ctx_err_msg = '''\
@@ -42,6 +42,31 @@ def _find_app():
     return top.app
 
 
+_context_local_classes = {
+    'thread': Local,
+    'contextvars': ContextVarLocal,
+}
+
+
+def _set_context_locals(name):
+    """Switches the storage of the context stacks to the given backend
+    (``'thread'`` or ``'contextvars'``).  The stacks are shared by every
+    application in the process, so this affects all of them and may only
+    be done while no context is pushed.
+    """
+    try:
+        local_class = _context_local_classes[name]
+    except KeyError:
+        raise ValueError('unknown context locals %r' % name)
+    for stack in _request_ctx_stack, _app_ctx_stack:
+        if isinstance(stack._local, local_class):
+            continue
+        if stack.top is not None:
+            raise RuntimeError('The context locals cannot be changed '
+                               'while a context is pushed.')
+        stack._local = local_class()
+
+
 # context locals
 _request_ctx_stack = LocalStack()       # 请求上下文的数据结构
 _app_ctx_stack = LocalStack()           # 应用上下文的数据结构
@@ -1,9 +1,53 @@
 #!/usr/bin/python3
 # -*- coding=utf-8 -*-
+import gzip
+import stat
+from collections import OrderedDict
+from threading import Lock
+
+
+class locked_cached_property(object):
+    """A decorator that converts a function into a lazy property.  The
+    function wrapped is called the first time to retrieve the result
+    and then that calculated result is used the next time you access
+    the value.  Works like the one in Werkzeug but has a lock for
+    thread safety.
+
+    The lock is only taken while the value is computed.  Afterwards the
+    value is found in the instance `__dict__`, which takes precedence over
+    this non-data descriptor, and a direct call of `__get__` checks for it
+    before locking.
+    """
+
+    def __init__(self, func, name=None, doc=None):
+        self.__name__ = name or func.__name__
+        self.__module__ = func.__module__
+        self.__doc__ = doc or func.__doc__
+        self.func = func
+        self.lock = RLock()
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+        value = obj.__dict__.get(self.__name__, _missing)
+        if value is not _missing:
+            return value
+        with self.lock:
+            # 加锁后再查一次，另一个线程可能已经算好了
+            value = obj.__dict__.get(self.__name__, _missing)
+            if value is _missing:
+                value = self.func(obj)
+                obj.__dict__[self.__name__] = value
+            return value
 
 
 class _PackageBoundObject(object):
 
+    #: The :class:`StaticFileCache` :meth:`send_static_file` serves from,
+    #: set up by :meth:`enable_static_cache`.  `None` reads every file
+    #: from the static folder.
+    static_cache = None
+
     def __init__(self, import_name, template_folder=None, root_path=None):
         #: The name of the package or module.  Do not change this once
         #: it was set by the constructor.
@@ -97,9 +141,82 @@ class _PackageBoundObject(object):
             raise RuntimeError('No static folder for this object')
         # Ensure get_send_file_max_age is called in all cases.
         # Here, we ensure get_send_file_max_age is called for Blueprints.
-        cache_timeout = self.get_send_file_max_age(filename)
-        return send_from_directory(self.static_folder, filename,
-                                   cache_timeout=cache_timeout)
+        encoding = None
+        if current_app.config['STATIC_PRECOMPRESSED']:
+            encoding = self._get_static_encoding(filename)
+        rv = None
+        if self.static_cache is not None:
+            rv = self.static_cache.send(self, filename, encoding)
+        if rv is None:
+            cache_timeout = self.get_send_file_max_age(filename)
+            rv = send_from_directory(self.static_folder,
+                                     encoding and filename + '.gz'
+                                     or filename,
+                                     cache_timeout=cache_timeout)
+        if encoding is not None:
+            # 同一个 URL 有两种表示，缓存必须按 Accept-Encoding 区分
+            rv.vary.add('Accept-Encoding')
+            if encoding:
+                rv.content_encoding = encoding
+        return rv
+
+    def _get_static_encoding(self, filename):
+        """Returns ``'gzip'`` if a precompressed ``.gz`` file exists next
+        to `filename` and the client accepts it, an empty string if the
+        client doesn't, and `None` if there is no such file.  A ``.gz``
+        file older than `filename`, or without `filename`, is stale and
+        counts as missing.
+        """
+        gz_filename = filename + '.gz'
+        gz_entry = entry = None
+        if self.static_cache is not None:
+            gz_entry = self.static_cache.get(gz_filename)
+            if gz_entry is not None:
+                entry = self.static_cache.get(filename)
+        if entry is not None:
+            gz_mtime, mtime = gz_entry.mtime, entry.mtime
+        else:
+            gz_path = safe_join(self.static_folder, gz_filename)
+            if not os.path.isfile(gz_path):
+                return None
+            try:
+                gz_mtime = os.path.getmtime(gz_path)
+                mtime = os.path.getmtime(safe_join(self.static_folder,
+                                                   filename))
+            except OSError:
+                return None
+        if gz_mtime < mtime:
+            return None
+        if request.accept_encodings['gzip']:
+            return 'gzip'
+        return ''
+
+    def precompress_static(self, **options):
+        """Writes a gzip compressed ``.gz`` file next to the files of the
+        static folder, see :func:`precompress_static_folder`.  They are
+        served if ``STATIC_PRECOMPRESSED`` is enabled.
+        """
+        if not self.has_static_folder:
+            raise RuntimeError('No static folder for this object')
+        return precompress_static_folder(self.static_folder, **options)
+
+    def enable_static_cache(self, max_memory=8 * 1024 * 1024,
+                            max_file_size=256 * 1024, revalidate_interval=2,
+                            preload=True):
+        """Serves the static files from a :class:`StaticFileCache` kept in
+        memory.  With `preload` the files of the static folder are loaded
+        right away, until `max_memory` bytes are used.  See
+        :class:`StaticFileCache` for the parameters.
+        """
+        if not self.has_static_folder:
+            raise RuntimeError('No static folder for this object')
+        self.static_cache = StaticFileCache(
+            self.static_folder, max_memory=max_memory,
+            max_file_size=max_file_size,
+            revalidate_interval=revalidate_interval)
+        if preload:
+            self.static_cache.preload()
+        return self.static_cache
 
     def open_resource(self, resource, mode='rb'):
         """Opens a resource from the application's resource folder.  To see
@@ -127,3 +244,221 @@ class _PackageBoundObject(object):
         if mode not in ('r', 'rb'):
             raise ValueError('Resources can only be opened for reading')
         return open(os.path.join(self.root_path, resource), mode)
+
+
+def precompress_static_folder(folder, min_size=1024,
+                              extensions=('.js', '.css', '.html', '.svg',
+                                          '.json', '.map', '.txt', '.xml'),
+                              compresslevel=9):
+    """Writes a gzip compressed copy ``name.gz`` next to every file in
+    `folder` that ends with one of `extensions` and is at least `min_size`
+    bytes, so :meth:`~_PackageBoundObject.send_static_file` can send it
+    without compressing anything per request.
+
+    Copies are written to a temporary file and moved into place, get the
+    modification time of the original and are skipped if they are still
+    up to date or not smaller than the original.  Copies of files that
+    shrank below `min_size` are removed.  Copies older than their original
+    are not served, run it again after the static files changed.  Returns
+    the list of written files.
+    """
+    written = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        for name in filenames:
+            if not name.endswith(extensions):
+                continue
+            path = os.path.join(dirpath, name)
+            gz_path = path + '.gz'
+            st = os.stat(path)
+            if st.st_size < min_size:
+                # 以前压缩过、现在变小的文件不能留下旧的副本
+                if os.path.exists(gz_path):
+                    os.remove(gz_path)
+                continue
+            try:
+                if os.stat(gz_path).st_mtime == st.st_mtime:
+                    continue
+            except OSError:
+                pass
+            tmp_path = '%s.%d.tmp' % (gz_path, os.getpid())
+            try:
+                with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                    # mtime=0 让同一个文件总是得到相同的压缩结果
+                    with gzip.GzipFile('', 'wb', compresslevel, dst,
+                                       mtime=0) as gz:
+                        while True:
+                            data = src.read(64 * 1024)
+                            if not data:
+                                break
+                            gz.write(data)
+                if os.path.getsize(tmp_path) >= st.st_size:
+                    os.remove(tmp_path)
+                    if os.path.exists(gz_path):
+                        os.remove(gz_path)
+                    continue
+                os.utime(tmp_path, (st.st_atime, st.st_mtime))
+                os.replace(tmp_path, gz_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            written.append(gz_path)
+    return written
+
+
+class _StaticFile(object):
+
+    def __init__(self, data, mtime, mimetype, etag, checked):
+        self.data = data
+        self.mtime = mtime
+        self.mimetype = mimetype
+        self.etag = etag
+        self.checked = checked
+        #: filled in on the first request, :meth:`get_send_file_max_age`
+        #: needs the application context.
+        self.max_age = None
+
+
+class StaticFileCache(object):
+
+    """Keeps the contents of the files in a static folder in memory along
+    with the precomputed ETag, Last-Modified and Content-Type, so
+    :meth:`~_PackageBoundObject.send_static_file` doesn't stat or open the
+    file for every request and a conditional request is answered with
+    ``304 Not Modified`` from memory.
+
+    Files larger than `max_file_size` are not cached.  If the cached files
+    use more than `max_memory` bytes the least recently used ones are
+    dropped.  An entry is checked against the file's mtime and size when
+    it's used more than `revalidate_interval` seconds after the last
+    check; `None` never checks and relies on :meth:`rescan`.
+    """
+
+    def __init__(self, folder, max_memory=8 * 1024 * 1024,
+                 max_file_size=256 * 1024, revalidate_interval=2):
+        self.folder = folder
+        self.max_memory = max_memory
+        self.max_file_size = max_file_size
+        self.revalidate_interval = revalidate_interval
+        self.memory = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def _load(self, path, st):
+        with open(path, 'rb') as f:
+            data = f.read()
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        # 与 send_file 生成的 ETag 相同，浏览器缓存不会因为开启缓存而失效
+        etag = 'flask-%s-%s-%s' % (
+            st.st_mtime, st.st_size,
+            adler32(path.encode('utf-8') if isinstance(path, text_type)
+                    else path) & 0xffffffff)
+        return _StaticFile(data, st.st_mtime, mimetype, etag, time())
+
+    def _store(self, path, entry):
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.memory -= len(old.data)
+            self._entries[path] = entry
+            self.memory += len(entry.data)
+            while self.memory > self.max_memory and self._entries:
+                self.memory -= len(self._entries.popitem(last=False)[1].data)
+
+    def _discard(self, path):
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self.memory -= len(entry.data)
+
+    def _refresh(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._discard(path)
+            return None
+        if not stat.S_ISREG(st.st_mode) or st.st_size > self.max_file_size:
+            self._discard(path)
+            return None
+        entry = self._load(path, st)
+        if len(entry.data) != st.st_size:
+            return None
+        self._store(path, entry)
+        return entry
+
+    def get(self, filename):
+        """Returns the cached entry for `filename`, loading it if needed,
+        or `None` if the file can't be cached.
+        """
+        path = safe_join(self.folder, filename)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                self._entries.move_to_end(path)
+        if entry is None:
+            return self._refresh(path)
+        interval = self.revalidate_interval
+        if interval is not None and time() - entry.checked > interval:
+            try:
+                st = os.stat(path)
+            except OSError:
+                self._discard(path)
+                return None
+            if st.st_mtime != entry.mtime or st.st_size != len(entry.data):
+                return self._refresh(path)
+            entry.checked = time()
+        return entry
+
+    def send(self, owner, filename, encoding=None):
+        """Returns the response for `filename` or `None` if it's not in
+        the cache.  `owner` is the application or blueprint whose
+        :meth:`~_PackageBoundObject.get_send_file_max_age` is used.  With
+        `encoding` set to ``'gzip'`` the ``.gz`` file next to it is sent.
+        """
+        entry = self.get(encoding and filename + '.gz' or filename)
+        if entry is None:
+            return None
+        if entry.max_age is None:
+            entry.max_age = owner.get_send_file_max_age(filename)
+        rv = current_app.response_class(entry.data, mimetype=entry.mimetype)
+        rv.last_modified = int(entry.mtime)
+        rv.cache_control.public = True
+        if entry.max_age:
+            rv.cache_control.max_age = entry.max_age
+            rv.expires = int(time() + entry.max_age)
+        rv.set_etag(entry.etag)
+        return rv.make_conditional(request, accept_ranges=True,
+                                   complete_length=len(entry.data))
+
+    def preload(self):
+        """Loads the files of the folder until the memory budget is used
+        up.
+        """
+        for dirpath, dirnames, filenames in os.walk(self.folder):
+            for name in filenames:
+                if self.memory >= self.max_memory:
+                    return
+                self._refresh(os.path.join(dirpath, name))
+
+    def rescan(self):
+        """Checks every cached entry against its file and reloads or drops
+        the ones that changed.  Use it with `revalidate_interval` set to
+        `None`, e.g. after a deployment.
+        """
+        with self._lock:
+            entries = list(self._entries.items())
+        for path, entry in entries:
+            try:
+                st = os.stat(path)
+            except OSError:
+                self._discard(path)
+                continue
+            if st.st_mtime != entry.mtime or st.st_size != len(entry.data):
+                self._refresh(path)
+            else:
+                entry.checked = time()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.memory = 0
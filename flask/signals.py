@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# -*- coding=utf-8 -*-
+import logging
+from threading import Lock, Thread
+
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+
+signals_available = False
+try:
+    from blinker import Namespace
+    signals_available = True
+except ImportError:
+    class Namespace(object):
+        def signal(self, name, doc=None):
+            return _FakeSignal(name, doc)
+
+    class _FakeSignal(object):
+        """If blinker is unavailable, create a fake class with the same
+        interface that allows sending of signals but will fail with an
+        error on anything else.  Instead of doing anything on send, it
+        will just ignore the arguments and do nothing instead.
+        """
+
+        def __init__(self, name, doc=None):
+            self.name = name
+            self.__doc__ = doc
+            #: always empty, so ``if signal.receivers:`` skips sending
+            self.receivers = {}
+        def _fail(self, *args, **kwargs):
+            raise RuntimeError('signalling support is unavailable '
+                               'because the blinker library is '
+                               'not installed.')
+        send = lambda *a, **kw: None
+        connect = disconnect = has_receivers_for = receivers_for = \
+            temporarily_connected_to = connected_to = _fail
+        del _fail
+
+# The namespace for code signals.  If you are not Flask code, do
+# not put signals in here.  Create your own namespace instead.
+_signals = Namespace()
+
+
+# Core signals.  For usage examples grep the source code or consult
+# the API documentation in docs/api.rst as well as docs/signals.rst
+template_rendered = _signals.signal('template-rendered')
+before_render_template = _signals.signal('before-render-template')
+request_started = _signals.signal('request-started')
+request_finished = _signals.signal('request-finished')
+request_tearing_down = _signals.signal('request-tearing-down')
+got_request_exception = _signals.signal('got-request-exception')
+appcontext_tearing_down = _signals.signal('appcontext-tearing-down')
+appcontext_pushed = _signals.signal('appcontext-pushed')
+appcontext_popped = _signals.signal('appcontext-popped')
+message_flashed = _signals.signal('message-flashed')
+
+
+_logger = logging.getLogger('flask.signals')
+
+
+class DeferredReceiver(object):
+    """Wraps a signal receiver so it runs on a background thread instead
+    of the thread that sends the signal.  Calls are put in a queue of at
+    most `maxsize` entries.  If the queue is full the call is dropped and
+    counted in :attr:`dropped`, the sender never waits.
+
+    The receiver runs after the request is over, so it must not use
+    :data:`~flask.request` or other context locals and should treat the
+    objects it is sent (like the response) as read-only.  It's meant for
+    things like metrics.  Use :func:`connect_deferred` to connect it.
+    """
+
+    def __init__(self, func, maxsize=1000):
+        self.func = func
+        self.queue = Queue(maxsize)
+        #: The number of calls that were dropped because the queue was full.
+        self.dropped = 0
+        self._lock = Lock()
+        self._thread = None
+
+    def __call__(self, sender, **kwargs):
+        try:
+            self.queue.put_nowait((sender, kwargs))
+        except Full:
+            with self._lock:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped == 1 or dropped % 1000 == 0:
+                _logger.warning('Queue of deferred receiver %r is full, '
+                                '%d signals dropped so far',
+                                self.func, dropped)
+            return
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                thread = Thread(target=self._run,
+                                name='flask-deferred-%s' %
+                                getattr(self.func, '__name__', 'receiver'))
+                thread.daemon = True
+                thread.start()
+                self._thread = thread
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                sender, kwargs = item
+                try:
+                    self.func(sender, **kwargs)
+                except Exception:
+                    _logger.exception('Error in deferred receiver %r',
+                                      self.func)
+            finally:
+                self.queue.task_done()
+
+    def close(self, timeout=None):
+        """Stops the worker thread after the queued calls were delivered."""
+        thread = self._thread
+        if thread is not None:
+            self.queue.put(None)
+            thread.join(timeout)
+            self._thread = None
+
+
+def connect_deferred(signal, func, sender=None, maxsize=1000):
+    """Connects `func` to `signal` through a :class:`DeferredReceiver` and
+    returns the receiver.  Example::
+
+        def record_request(sender, response, **extra):
+            metrics.observe(response.status_code)
+
+        connect_deferred(request_finished, record_request, sender=app)
+
+    The receiver is connected with a strong reference, disconnect it with
+    ``signal.disconnect(receiver)``.
+    """
+    receiver = DeferredReceiver(func, maxsize)
+    if sender is None:
+        signal.connect(receiver, weak=False)
+    else:
+        signal.connect(receiver, sender=sender, weak=False)
+    return receiver
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+# -*- coding=utf-8 -*-
+import errno
+import os
+import tempfile
+
+from jinja2 import FileSystemBytecodeCache
+
+
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+
+    """Stores the compiled templates in `directory`, so new workers and
+    restarted processes load them instead of compiling every template
+    again.  Enabled with the ``TEMPLATE_BYTECODE_CACHE`` config key.
+
+    There is one file per template.  It stores the checksum of the source
+    it was compiled from, and a changed template is compiled again and
+    replaces the file, so the directory doesn't collect stale entries.
+    Files are written to a temporary name and renamed into place, so
+    processes sharing the directory never read a half written file.  If
+    `directory` can't be created, e.g. on a read-only instance path,
+    nothing is cached and the templates are compiled as usual.
+    """
+
+    def __init__(self, directory, pattern='__flask_jinja2_%s.cache'):
+        #: `False` if the directory couldn't be created.
+        self.enabled = True
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                self.enabled = False
+        FileSystemBytecodeCache.__init__(self, directory, pattern)
+
+    def load_bytecode(self, bucket):
+        if not self.enabled:
+            return
+        try:
+            f = open(self._get_cache_filename(bucket), 'rb')
+        except (IOError, OSError):
+            return
+        try:
+            bucket.load_bytecode(f)
+        except Exception:
+            # 损坏或不兼容的缓存文件当作未命中，重新编译后会覆盖；
+            # 源码校验和不一致时 Bucket 自己会重置
+            bucket.reset()
+        finally:
+            f.close()
+
+    def dump_bytecode(self, bucket):
+        if not self.enabled:
+            return
+        filename = self._get_cache_filename(bucket)
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.directory,
+                                       prefix=os.path.basename(filename),
+                                       suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.replace(tmp, filename)
+        except OSError:
+            # 缓存目录不可写时只是不缓存，模板照常渲染
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
@@ -1,5 +1,56 @@
 #!/usr/bin/python3
 # -*- coding=utf-8 -*-
+import codecs
+
+from werkzeug.formparser import iter_multipart_parts
+
+
+# 头名到 environ 键的转换结果，例如 'Content-Type' -> 'CONTENT_TYPE'
+_environ_header_keys = {}
+
+# 没有查询字符串的请求共用的空 args
+_empty_args = ImmutableMultiDict()
+
+
+def _json_truncated(e, buf):
+    """Tells if the decode error `e` may be caused by `buf` ending in the
+    middle of a value rather than by invalid JSON.
+    """
+    pos = getattr(e, 'pos', None)
+    if pos is None:
+        # Python 2 的 json 模块不提供错误位置
+        return True
+    # 被截断的字面量（例如 '-Infin'）和转义序列都在末尾几个字符之内，
+    # 被截断的字符串报告的是字符串开头的位置
+    return pos >= len(buf) - len('-Infinity') or \
+        getattr(e, 'msg', '').startswith('Unterminated string')
+
+
+class _EnvironHeaders(EnvironHeaders):
+    """The read-only view over the ``HTTP_*`` keys of the WSGI environ
+    used as :attr:`Request.headers`.  Nothing is copied, and the
+    translation of a header name to its environ key is remembered, so
+    reading the same few headers on every request doesn't build the key
+    again.
+    """
+
+    #: The number of translated header names that are remembered.  Names
+    #: beyond that are translated on every access.
+    max_cached_keys = 512
+
+    def __getitem__(self, key, _get_mode=False):
+        try:
+            environ_key = _environ_header_keys[key]
+        except (KeyError, TypeError):
+            # 整数、切片等不是头名的键和 EnvironHeaders 一样当作不存在
+            if not isinstance(key, string_types):
+                raise KeyError(key)
+            environ_key = key.upper().replace('-', '_')
+            if environ_key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ_key = 'HTTP_' + environ_key
+            if len(_environ_header_keys) < self.max_cached_keys:
+                _environ_header_keys[key] = environ_key
+        return _unicodify_header_value(self.environ[environ_key])
 
 
 class Request(RequestBase):
@@ -9,14 +60,67 @@ class Request(RequestBase):
     specific ones.
     """
 
-    #: The internal URL rule that matched the request.  This can be
-    #: useful to inspect which methods are allowed for the URL from
-    #: a before/after handler (``request.url_rule.methods``) etc.
-    url_rule = None
+    def __getattr__(self, name):
+        """Provides the routing results that aren't set on the request:
+
+        ``url_rule``
+            The internal URL rule that matched the request.  This can be
+            useful to inspect which methods are allowed for the URL from
+            a before/after handler (``request.url_rule.methods``) etc.
+        ``view_args``
+            A dict of view arguments that matched the request.  If an
+            exception happened when matching, this will be ``None``.
+        ``routing_exception``
+            If matching the URL failed, this is the exception that will be
+            raised / was raised as part of the request handling.  This is
+            usually a :exc:`~werkzeug.exceptions.NotFound` exception or
+            something similar.
+
+        If the request context deferred the URL matching, the first read
+        runs it.  They are ``None`` if the URL isn't matched.
+        """
+        if name not in ('url_rule', 'view_args', 'routing_exception'):
+            raise AttributeError(name)
+        d = self.__dict__
+        if d.get('_deferred_match'):
+            ctx = _request_ctx_stack.top
+            if ctx is not None and ctx.request is self:
+                ctx.match_request()
+                # 匹配出错时保留标记，下次读取会重新匹配
+                d.pop('_deferred_match', None)
+                if name in d:
+                    return d[name]
+        return None
+
+    #: Parts read by :meth:`iter_parts` that are larger than this many
+    #: bytes are spooled to a temporary file instead of kept in memory.
+    part_memory_threshold = 500 * 1024
+
+    #: The largest single item :meth:`iter_json` buffers while waiting
+    #: for the rest of it, in characters.  Larger items fail the request
+    #: with :exc:`~werkzeug.exceptions.RequestEntityTooLarge`.
+    max_json_item_size = 1024 * 1024
+
+    @cached_property
+    def headers(self):
+        """The headers from the WSGI environ as an immutable view that
+        reads the environ on access, see :class:`_EnvironHeaders`.
+        """
+        return _EnvironHeaders(self.environ)
 
-    #: A dict of view arguments that matched the request.  If an exception
-    #: happened when matching, this will be ``None``.
-    view_args = None
+    @cached_property
+    def args(self):
+        """The parsed URL parameters.  The query string is only parsed
+        when this is accessed; requests without one share a single empty
+        :class:`~werkzeug.datastructures.ImmutableMultiDict`.
+        """
+        query_string = self.environ.get('QUERY_STRING')
+        if not query_string and \
+                self.parameter_storage_class is ImmutableMultiDict:
+            return _empty_args
+        return url_decode(wsgi_get_bytes(query_string or ''),
+                          self.url_charset, errors=self.encoding_errors,
+                          cls=self.parameter_storage_class)
 
     @property
     def max_content_length(self):
@@ -25,6 +129,39 @@ class Request(RequestBase):
         if ctx is not None:
             return ctx.app.config['MAX_CONTENT_LENGTH']
 
+    def iter_parts(self):
+        """Iterates over the parts of a ``multipart/form-data`` body as
+        :class:`~werkzeug.formparser.StreamedPart` objects.  Unlike
+        :attr:`form` and :attr:`files` the body is parsed while iterating,
+        one part at a time, and parts larger than
+        :attr:`part_memory_threshold` go to a temporary file, so large
+        uploads don't have to fit into memory::
+
+            from werkzeug.utils import secure_filename
+
+            for part in request.iter_parts():
+                with part:
+                    if part.is_file:
+                        filename = secure_filename(part.filename)
+                        part.save(os.path.join(upload_dir, filename))
+
+        The body can only be read once, use either this or :attr:`form`
+        and :attr:`files`.
+        """
+        if self.mimetype != 'multipart/form-data':
+            raise BadRequest('Expected a multipart/form-data body')
+        boundary = self.mimetype_params.get('boundary')
+        if not boundary:
+            raise BadRequest('Missing multipart boundary')
+        max_length = self.max_content_length
+        if max_length is not None and self.content_length is not None and \
+                self.content_length > max_length:
+            raise RequestEntityTooLarge()
+        return iter_multipart_parts(self.stream, boundary.encode('latin1'),
+                                    self.part_memory_threshold,
+                                    charset=self.charset,
+                                    errors=self.encoding_errors)
+
     @property
     def endpoint(self):
         """The endpoint that matched the request.  This in combination with
@@ -41,16 +178,222 @@ class Request(RequestBase):
         if self.url_rule and '.' in self.url_rule.endpoint:
             return self.url_rule.endpoint.rsplit('.', 1)[0]
 
-    @property
+    @cached_property
     def is_json(self):
+        """Indicates if this request is JSON or not.  By default a request
+        is considered to include JSON data if the mimetype is
+        :mimetype:`application/json` or :mimetype:`application/*+json`.
+
+        .. versionadded:: 0.11
+        """
         mt = self.mimetype
         if mt == 'application/json':
             return True
         if mt.startswith('application/') and mt.endswith('+json'):
             return True
         return False
-    
-    
+
+    @property
+    def json(self):
+        """If the mimetype is :mimetype:`application/json` this will contain
+        the parsed JSON data.  Otherwise this will be ``None``.
+
+        The :meth:`get_json` method should be used instead.
+        """
+        return self.get_json()
+
+    # get_json 的缓存：(非 silent 的结果, silent 的结果)，Ellipsis 表示还没解析
+    _cached_json = (Ellipsis, Ellipsis)
+
+    def _get_json_loads(self):
+        ctx = _request_ctx_stack.top
+        if ctx is not None and ctx.app.json_loads is not None:
+            return ctx.app.json_loads
+        return json.loads
+
+    def get_json(self, force=False, silent=False, cache=True):
+        """Parses the incoming JSON request data and returns it.  By default
+        this function will return ``None`` if the mimetype is not
+        :mimetype:`application/json` but this can be overridden by the
+        ``force`` parameter.  If parsing fails the
+        :meth:`on_json_loading_failed` method on the request object will be
+        invoked.
+
+        The body is parsed once per request, later calls return the cached
+        result.  A failed ``silent`` parse doesn't hide the error from a
+        later call without ``silent``.
+
+        :param force: if set to ``True`` the mimetype is ignored.
+        :param silent: if set to ``True`` this method will fail silently
+                       and return ``None``.
+        :param cache: if set to ``True`` the parsed JSON data is remembered
+                      on the request.
+        """
+        if cache:
+            rv = self._cached_json[silent]
+            if rv is not Ellipsis:
+                return rv
+
+        if not (force or self.is_json):
+            return None
+
+        loads = self._get_json_loads()
+        request_charset = self.mimetype_params.get('charset')
+        try:
+            data = _get_data(self, cache)
+            if request_charset is not None and \
+                    request_charset.lower().replace('-', '') != 'utf8':
+                data = data.decode(request_charset)
+            rv = loads(data)
+        except ValueError as e:
+            if silent:
+                rv = None
+                if cache:
+                    self._cached_json = (self._cached_json[0], rv)
+            else:
+                rv = self.on_json_loading_failed(e)
+                if cache:
+                    self._cached_json = (rv, self._cached_json[1])
+        else:
+            if cache:
+                self._cached_json = (rv, rv)
+        return rv
+
+    def iter_json(self, chunk_size=64 * 1024):
+        """Decodes a large JSON body incrementally and yields the items as
+        they are decoded, without loading the whole body first.  For
+        :mimetype:`application/x-ndjson` every line is one item, for
+        JSON the body has to be an array and its elements are yielded.
+        Decoding errors go through :meth:`on_json_loading_failed`, and an
+        item longer than :attr:`max_json_item_size` aborts the request.
+
+        The body can only be read once; if it was read already, e.g. by
+        :meth:`get_json`, the items are taken from that.
+        """
+        if self.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            return self._iter_json_lines(chunk_size)
+        if not self.is_json:
+            raise BadRequest('Expected a JSON or NDJSON body')
+        return self._iter_json_array(chunk_size)
+
+    def _iter_json_chunks(self, chunk_size):
+        charset = self.mimetype_params.get('charset') or 'utf-8'
+        decoder = codecs.getincrementaldecoder(charset)('strict')
+        if '_cached_data' in self.__dict__:
+            yield decoder.decode(self._cached_data, True)
+            return
+        read = self.stream.read
+        while True:
+            data = read(chunk_size)
+            yield decoder.decode(data, not data)
+            if not data:
+                return
+
+    def _iter_json_lines(self, chunk_size):
+        loads = self._get_json_loads()
+        rest = ''
+        try:
+            for text in self._iter_json_chunks(chunk_size):
+                lines = (rest + text).split('\n')
+                rest = lines.pop()
+                if len(rest) > self.max_json_item_size:
+                    raise RequestEntityTooLarge()
+                for line in lines:
+                    if line.strip():
+                        yield loads(line)
+            if rest.strip():
+                yield loads(rest)
+        except ValueError as e:
+            yield self.on_json_loading_failed(e)
+
+    def _iter_json_array(self, chunk_size):
+        raw_decode = _request_ctx_stack.top.app.json_decoder().raw_decode
+        chunks = self._iter_json_chunks(chunk_size)
+
+        def more():
+            for text in chunks:
+                if text:
+                    return text
+
+        buf = ''
+        pos = 0
+        # 状态：'[' 之前、元素之前、元素之后（等待 ',' 或 ']'）
+        expect = '['
+        try:
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n':
+                    pos += 1
+                if pos == len(buf):
+                    text = more()
+                    if text is None:
+                        raise ValueError('Unexpected end of JSON array')
+                    buf = buf[pos:] + text
+                    pos = 0
+                    continue
+                char = buf[pos]
+                if expect == '[':
+                    if char != '[':
+                        raise ValueError('Expected a JSON array')
+                    pos += 1
+                    expect = 'item'
+                elif expect == ',':
+                    if char == ']':
+                        return
+                    if char != ',':
+                        raise ValueError('Expected "," or "]" in JSON array')
+                    pos += 1
+                    expect = 'item!'
+                elif char == ']' and expect == 'item':
+                    return
+                else:
+                    try:
+                        item, end = raw_decode(buf, pos)
+                    except ValueError as e:
+                        # 只有错误出现在缓冲区末尾时元素才可能是没读完整，
+                        # 其它位置的错误直接失败，不再读完整个请求体
+                        if not _json_truncated(e, buf):
+                            raise
+                        text = more()
+                        if text is None:
+                            raise
+                        buf = buf[pos:] + text
+                        pos = 0
+                        if len(buf) > self.max_json_item_size:
+                            raise RequestEntityTooLarge()
+                        continue
+                    tail = buf[end:end + 3]
+                    if len(tail) <= 2 and tail[:1] in ('', '.', 'e', 'E'):
+                        # 数字可能在块边界被截断（例如 '12'、'1.'、'1e-'），
+                        # 读到后面的字符再确认
+                        text = more()
+                        if text is not None:
+                            buf = buf[pos:] + text
+                            pos = 0
+                            continue
+                    yield item
+                    pos = end
+                    expect = ','
+        except ValueError as e:
+            yield self.on_json_loading_failed(e)
+
+    def on_json_loading_failed(self, e):
+        """Called if decoding of the JSON data failed.  The return value of
+        this method is used by :meth:`get_json` when an error occurred.  The
+        default implementation just raises a :class:`BadRequest` exception.
+
+        .. versionchanged:: 0.10
+           Removed buggy previous behavior of generating a random JSON
+           response.  If you want that behavior back you can trivially
+           add it by subclassing.
+
+        .. versionadded:: 0.8
+        """
+        ctx = _request_ctx_stack.top
+        if ctx is not None and ctx.app.config.get('DEBUG', False):
+            raise BadRequest('Failed to decode JSON object: {0}'.format(e))
+        raise BadRequest()
+
+
 class Response(ResponseBase):
     """The response object that is used by default in Flask.  Works like the
     response object from Werkzeug but is set to have an HTML mimetype by
@@ -61,6 +404,25 @@ class Response(ResponseBase):
     set :attr:`~flask.Flask.response_class` to your subclass.
     """
     default_mimetype = 'text/html'
-    
-    
-    
\ No newline at end of file
+
+
+class PreEncodedResponse(Response):
+    """A response for a body that is already encoded, like a JSON blob
+    serialised ahead of time.  The bytes are passed through untouched: the
+    content type is used as given without adding a charset, the
+    ``Content-Length`` is set once from the length of the body and the
+    body is not run through the encoding iterator.  The body has to be
+    bytes; text raises :exc:`TypeError` since its length isn't the length
+    that is sent.
+    """
+    default_mimetype = 'application/json'
+
+    def __init__(self, body, status=None, headers=None, content_type=None):
+        if not isinstance(body, bytes):
+            raise TypeError('PreEncodedResponse needs a bytes body, got %s'
+                            % type(body).__name__)
+        Response.__init__(self, None, status=status, headers=headers,
+                          content_type=content_type or self.default_mimetype,
+                          direct_passthrough=True)
+        self.response = [body]
+        self.headers['Content-Length'] = str(len(body))
@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+# -*- coding=utf-8 -*-
+import shutil
+from tempfile import SpooledTemporaryFile
+
+
+class StreamedPart(object):
+
+    """One part of a multipart body returned by :func:`iter_multipart_parts`.
+    The data is held in a :class:`~tempfile.SpooledTemporaryFile` that stays
+    in memory up to the threshold given to the parser and is moved to a
+    temporary file on disk beyond it.  :attr:`stream` is positioned at the
+    start of the data.
+
+    Close the part, or use it as a context manager, once it's handled so
+    a spooled temporary file is removed right away.
+    """
+
+    def __init__(self, name, filename, headers, stream, size, charset,
+                 errors):
+        #: the name of the form field.
+        self.name = name
+        #: the file name sent by the client, `None` for plain fields.
+        self.filename = filename
+        #: the :class:`Headers` of the part.
+        self.headers = headers
+        #: the file-like object with the data of the part.
+        self.stream = stream
+        #: the size of the data in bytes.
+        self.size = size
+        self.charset = charset
+        self.errors = errors
+
+    @property
+    def content_type(self):
+        return self.headers.get('content-type')
+
+    @property
+    def mimetype(self):
+        return parse_options_header(self.content_type)[0]
+
+    @property
+    def is_file(self):
+        return self.filename is not None
+
+    @property
+    def value(self):
+        """The data of a plain form field decoded with the charset of the
+        request.
+        """
+        return self.read().decode(self.charset, self.errors)
+
+    def read(self):
+        self.stream.seek(0)
+        return self.stream.read()
+
+    def save(self, dst, buffer_size=16384):
+        """Copies the data to `dst`, a path or a file-like object, without
+        loading it into memory at once.
+        """
+        self.stream.seek(0)
+        if isinstance(dst, string_types):
+            with open(dst, 'wb') as f:
+                shutil.copyfileobj(self.stream, f, buffer_size)
+        else:
+            shutil.copyfileobj(self.stream, dst, buffer_size)
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __repr__(self):
+        return '<%s %r %r (%d bytes)>' % (self.__class__.__name__,
+                                          self.name, self.filename,
+                                          self.size)
+
+
+def iter_multipart_parts(stream, boundary, max_memory=500 * 1024,
+                         buffer_size=64 * 1024, max_header_size=16 * 1024,
+                         charset='utf-8', errors='replace'):
+    """Parses a ``multipart/form-data`` body from `stream` incrementally
+    and yields a :class:`StreamedPart` for every part.  The stream is read
+    in blocks of `buffer_size` bytes only as far as needed for the next
+    part, so the memory used is bounded by `max_memory` per part and not
+    by the size of the body.
+
+    Raises :exc:`~werkzeug.exceptions.BadRequest` for malformed bodies.
+
+    :param stream: the request body, limited to its content length.
+    :param boundary: the boundary from the content type as bytes.
+    :param max_memory: parts larger than this are spooled to disk.
+    """
+    separator = b'\r\n--' + boundary
+    # 正文前面补上 CRLF，第一个分隔符就和后面的分隔符一样处理
+    buf = bytearray(b'\r\n')
+
+    def fill():
+        data = stream.read(buffer_size)
+        if not data:
+            raise BadRequest('Unexpected end of multipart data')
+        buf.extend(data)
+
+    # 跳过第一个分隔符之前的内容
+    while True:
+        index = buf.find(separator)
+        if index >= 0:
+            del buf[:index + len(separator)]
+            break
+        del buf[:max(0, len(buf) - len(separator) + 1)]
+        fill()
+
+    while True:
+        while len(buf) < 2:
+            fill()
+        if buf[:2] == b'--':
+            return
+        # 分隔符所在行的剩余部分（可选的空白）一直到 CRLF
+        while True:
+            line_end = buf.find(b'\r\n')
+            if line_end >= 0:
+                break
+            if len(buf) > max_header_size:
+                raise BadRequest('Malformed multipart boundary')
+            fill()
+        del buf[:line_end + 2]
+
+        while True:
+            header_end = buf.find(b'\r\n\r\n')
+            if header_end >= 0 or buf[:2] == b'\r\n':
+                break
+            if len(buf) > max_header_size:
+                raise BadRequest('Multipart headers too large')
+            fill()
+        if buf[:2] == b'\r\n':
+            lines = []
+            del buf[:2]
+        else:
+            lines = bytes(buf[:header_end]).decode(charset, errors) \
+                .split('\r\n')
+            del buf[:header_end + 4]
+        headers = Headers()
+        for line in lines:
+            key, sep, value = line.partition(':')
+            if not sep:
+                raise BadRequest('Malformed multipart header')
+            headers.add(key.strip(), value.strip())
+        disposition, extra = parse_options_header(
+            headers.get('content-disposition'))
+        if disposition != 'form-data' or 'name' not in extra:
+            raise BadRequest('Missing form-data disposition')
+
+        part = SpooledTemporaryFile(max_size=max_memory)
+        size = 0
+        try:
+            while True:
+                index = buf.find(separator)
+                if index >= 0:
+                    part.write(buf[:index])
+                    size += index
+                    del buf[:index + len(separator)]
+                    break
+                # 保留可能是分隔符开头的尾部
+                keep = len(separator) - 1
+                if len(buf) > keep:
+                    part.write(buf[:-keep])
+                    size += len(buf) - keep
+                    del buf[:-keep]
+                fill()
+        except BaseException:
+            part.close()
+            raise
+        part.seek(0)
+        yield StreamedPart(extra['name'], extra.get('filename'), headers,
+                           part, size, charset, errors)
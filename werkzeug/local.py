@@ -10,7 +10,28 @@ except ImportError:
         from thread import get_ident
     except ImportError:
         from _thread import get_ident
-  
+
+try:
+    from contextvars import ContextVar
+    from asyncio import current_task
+except ImportError:
+    ContextVar = None
+
+
+def _get_context_ident():
+    """Identifies the current asyncio task, or the current thread or
+    greenlet outside of a running event loop.
+    """
+    try:
+        task = current_task()
+    except RuntimeError:
+        # 没有运行中的事件循环
+        task = None
+    if task is not None:
+        return task
+    return get_ident()
+
+
 def release_local(local):
     """Releases the contents of the local for the current context.
     This makes it possible to use locals without a manager.
@@ -60,15 +81,76 @@ class Local(object):
             raise AttributeError(name)
 
 
+class ContextVarLocal(object):
+    """Works like :class:`Local` but keeps the data in a
+    :class:`contextvars.ContextVar` instead of a dict keyed by
+    :func:`get_ident`.  Threads, greenlets and asyncio tasks each see
+    their own values, and the values go away together with the context
+    that set them.
+
+    The stored dict is never changed in place, every assignment sets a
+    new copy.  A task started from a context therefore can't change the
+    values the parent context sees.
+
+    The storage doesn't depend on :attr:`__ident_func__`; it's provided
+    for code that keys its own data by it, like scoped database sessions,
+    and returns the current task or else the current thread or greenlet.
+    """
+    __slots__ = ('__storage__', '__ident_func__')
+
+    def __init__(self):
+        if ContextVar is None:
+            raise RuntimeError('contextvars are not available on this '
+                               'Python version, use Local instead.')
+        object.__setattr__(self, '__storage__', ContextVar(
+            'werkzeug.local.%d' % id(self), default={}))
+        object.__setattr__(self, '__ident_func__', _get_context_ident)
+
+    def __iter__(self):
+        return iter(self.__storage__.get().items())
+
+    def __call__(self, proxy):
+        """Create a proxy for a name."""
+        return LocalProxy(self, proxy)
+
+    def __release_local__(self):
+        self.__storage__.set({})
+
+    def __getattr__(self, name):
+        try:
+            return self.__storage__.get()[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        # 写时复制，不修改父上下文里的 dict
+        values = dict(self.__storage__.get())
+        values[name] = value
+        self.__storage__.set(values)
+
+    def __delattr__(self, name):
+        values = dict(self.__storage__.get())
+        try:
+            del values[name]
+        except KeyError:
+            raise AttributeError(name)
+        self.__storage__.set(values)
+
 
 class LocalStack(object):
 
     """This class works similar to a :class:`Local` but keeps a stack
     of objects instead.  This is best explained with an example::
+
+    The storage is a :class:`Local` by default.  Pass a
+    :class:`ContextVarLocal` as `local` to keep the stack in a context
+    variable instead.
     """
 
-    def __init__(self):
-        self._local = Local()
+    def __init__(self, local=None):
+        if local is None:
+            local = Local()
+        self._local = local
 
     def __release_local__(self):
         self._local.__release_local__()
@@ -93,8 +175,9 @@ class LocalStack(object):
         """Pushes a new item to the stack"""
         rv = getattr(self._local, 'stack', None)
         if rv is None:
-            self._local.stack = rv = []
-        rv.append(obj)
+            rv = []
+        # 栈同样写时复制：contextvars 后端下子任务拿到的是父上下文的同一个列表
+        self._local.stack = rv = rv + [obj]
         return rv
 
     def pop(self):
@@ -108,7 +191,8 @@ class LocalStack(object):
             release_local(self._local)
             return stack[-1]
         else:
-            return stack.pop()
+            self._local.stack = stack[:-1]
+            return stack[-1]
 
     @property
     def top(self):
@@ -122,14 +206,30 @@ class LocalStack(object):
         
         
         
+def _local_resolver(local, name):
+    """Returns a function that looks up `name` on a :class:`Local`."""
+    def _resolve():
+        try:
+            return getattr(local, name)
+        except AttributeError:
+            raise RuntimeError('no object bound to %s' % name)
+    return _resolve
+
+
 @implements_bool
 class LocalProxy(object):
 
     """Acts as a proxy for a werkzeug local.  Forwards all operations to
     a proxied object.  The only operations not supported for forwarding
     are right handed operands and any kind of assignment.
+
+    Whether the proxied object is looked up by calling a function or by
+    reading a name from a :class:`Local` is decided once in the
+    constructor.  Every operation afterwards calls the stored resolver
+    directly.
     """
-    __slots__ = ('__local', '__dict__', '__name__', '__wrapped__')
+    __slots__ = ('__local', '__dict__', '__name__', '__wrapped__',
+                 '__resolve')
 
     def __init__(self, local, name=None):
         object.__setattr__(self, '_LocalProxy__local', local)
@@ -138,30 +238,72 @@ class LocalProxy(object):
             # "local" is a callable that is not an instance of Local or
             # LocalManager: mark it as a wrapped function.
             object.__setattr__(self, '__wrapped__', local)
-           
-   def _get_current_object(self):
+            resolve = local
+        else:
+            resolve = _local_resolver(local, name)
+        object.__setattr__(self, '_LocalProxy__resolve', resolve)
+
+    def _get_current_object(self):
         """Return the current object.  This is useful if you want the real
         object behind the proxy at a time for performance reasons or because
         you want to pass the object into a different context.
+
+        This is also the way to pin the object for the rest of a request.
+        A view that uses :data:`flask.request` a lot can do::
+
+            req = request._get_current_object()
+
+        and work with `req`, which is a plain attribute access without
+        going through the proxy and the context stack every time.  The
+        pinned object must not be kept beyond the request.
         """
-        if not hasattr(self.__local, '__release_local__'):
-            return self.__local()
-        try:
-            return getattr(self.__local, self.__name__)
-        except AttributeError:
-            raise RuntimeError('no object bound to %s' % self.__name__) 
-        
+        return self.__resolve()
+
     def __getattr__(self, name):
         if name == '__members__':
-            return dir(self._get_current_object())
-        return getattr(self._get_current_object(), name)
-            
-            
-            
-            
-            
-            
-            
-            
-            
-            
\ No newline at end of file
+            return dir(self.__resolve())
+        return getattr(self.__resolve(), name)
+
+    # 常用的魔术方法直接调用解析函数，省去一次 _get_current_object 方法查找
+    def __repr__(self):
+        try:
+            obj = self.__resolve()
+        except RuntimeError:
+            return '<%s unbound>' % self.__class__.__name__
+        return repr(obj)
+
+    def __bool__(self):
+        try:
+            return bool(self.__resolve())
+        except RuntimeError:
+            return False
+
+    def __dir__(self):
+        try:
+            return dir(self.__resolve())
+        except RuntimeError:
+            return []
+
+    def __setitem__(self, key, value):
+        self.__resolve()[key] = value
+
+    def __delitem__(self, key):
+        del self.__resolve()[key]
+
+    __setattr__ = lambda x, n, v: setattr(x.__resolve(), n, v)
+    __delattr__ = lambda x, n: delattr(x.__resolve(), n)
+    __str__ = lambda x: str(x.__resolve())
+    __lt__ = lambda x, o: x.__resolve() < o
+    __le__ = lambda x, o: x.__resolve() <= o
+    __eq__ = lambda x, o: x.__resolve() == o
+    __ne__ = lambda x, o: x.__resolve() != o
+    __gt__ = lambda x, o: x.__resolve() > o
+    __ge__ = lambda x, o: x.__resolve() >= o
+    __hash__ = lambda x: hash(x.__resolve())
+    __call__ = lambda x, *a, **kw: x.__resolve()(*a, **kw)
+    __len__ = lambda x: len(x.__resolve())
+    __getitem__ = lambda x, i: x.__resolve()[i]
+    __iter__ = lambda x: iter(x.__resolve())
+    __contains__ = lambda x, i: i in x.__resolve()
+    __enter__ = lambda x: x.__resolve().__enter__()
+    __exit__ = lambda x, *a, **kw: x.__resolve().__exit__(*a, **kw)
@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 # -*- coding=utf-8 -*-
-
+import re
+from collections import OrderedDict, namedtuple
 
 class Map(object):
 
@@ -16,12 +17,30 @@ class Map(object):
     def __init__(self, rules=None, default_subdomain='', charset='utf-8',
                  strict_slashes=True, redirect_defaults=True,
                  converters=None, sort_parameters=False, sort_key=None,
-                 encoding_errors='replace', host_matching=False):
+                 encoding_errors='replace', host_matching=False,
+                 radix_matching=False, match_cache_size=None):
         self._rules = []
         self._rules_by_endpoint = {}
         self._remap = True
         self._remap_lock = Lock()
 
+        #: if enabled the rules are compiled into a :class:`RadixMatcher`
+        #: on :meth:`update` and matching only looks at the rules whose
+        #: path segments fit the requested path.
+        self.radix_matching = radix_matching
+        self._matcher = None
+
+        #: ``(domain, path) -> [rules]`` for the rules without converters,
+        #: filled by :meth:`update`.
+        self._static_rules = {}
+
+        #: an optional :class:`MatchCache` for the results of
+        #: :meth:`MapAdapter.match`.  Use :meth:`match_cache_info` to see
+        #: how well it works for the current size.
+        self._match_cache = None
+        if match_cache_size:
+            self._match_cache = MatchCache(match_cache_size)
+
         self.default_subdomain = default_subdomain
         self.charset = charset
         self.encoding_errors = encoding_errors
@@ -38,6 +57,88 @@ class Map(object):
 
         for rulefactory in rules or ():
             self.add(rulefactory)
+
+    def add(self, rulefactory):
+        """Add a new rule or factory to the map and bind it.  Requires that the
+        rule is not bound to another map.
+
+        :param rulefactory: a :class:`Rule` or :class:`RuleFactory`
+        """
+        for rule in rulefactory.get_rules(self):
+            rule.bind(self)
+            self._rules.append(rule)
+            self._rules_by_endpoint.setdefault(rule.endpoint, []).append(rule)
+        self._remap = True
+        if self._match_cache is not None:
+            self._match_cache.clear()
+
+    def match_cache_info(self):
+        """Returns a :class:`MatchCacheInfo` with the hit and miss counts
+        of the match cache or `None` if the map has no match cache.
+        """
+        if self._match_cache is not None:
+            return self._match_cache.info()
+
+    def update(self):
+        """Called before matching and building to keep the compiled rules
+        in the correct order after things changed.
+        """
+        if not self._remap:
+            return
+
+        with self._remap_lock:
+            if not self._remap:
+                return
+
+            self._rules.sort(key=lambda x: x.match_compare_key())
+            for rules in itervalues(self._rules_by_endpoint):
+                rules.sort(key=lambda x: x.build_compare_key())
+            self._static_rules = self._index_static_rules()
+            # 规则排序之后再编译前缀树，树里记录的是规则在 _rules 中的下标
+            if self.radix_matching:
+                self._matcher = RadixMatcher(self._rules)
+            else:
+                self._matcher = None
+            self._remap = False
+
+    def _index_static_rules(self):
+        """Indexes the rules that have no converters and no defaults by
+        their domain and path.  These rules sort before all rules with
+        arguments, so if one of them matches the path and the method no
+        other rule could have won.  Paths that are also claimed by static
+        alias or redirect rules, or that a strict rule ending with a slash
+        redirects, are not indexed and always go through the normal
+        matching.
+        """
+        index = {}
+        for rule in self._rules:
+            if rule.build_only or rule.arguments or rule._converters:
+                continue
+            domain = (rule.host if self.host_matching
+                      else rule.subdomain) or u''
+            keys = [(domain, rule.rule)]
+            redirect_keys = []
+            # 规则还能匹配的另一种写法：非严格规则多或少一个结尾斜杠，
+            # 严格的非叶子规则在没有斜杠时会重定向
+            if not rule.is_leaf:
+                if rule.strict_slashes:
+                    redirect_keys.append((domain, rule.rule.rstrip('/')))
+                else:
+                    keys.append((domain, rule.rule.rstrip('/')))
+            elif not rule.strict_slashes:
+                keys.append((domain, rule.rule + '/'))
+            for key in redirect_keys:
+                index[key] = None
+            for key in keys:
+                rules = index.get(key, ())
+                if rules is None:
+                    continue
+                if rule.alias or rule.redirect_to is not None:
+                    index[key] = None
+                else:
+                    index[key] = list(rules) + [rule]
+        return dict((key, tuple(rules)) for key, rules in iteritems(index)
+                    if rules is not None)
             
 @implements_to_string
 class Rule(RuleFactory):
@@ -77,4 +178,348 @@ class Rule(RuleFactory):
             self.arguments = set(map(str, defaults))
         else:
             self.arguments = set()
-        self._trace = self._converters = self._regex = self._argument_weights = None
\ No newline at end of file
+        self._trace = self._converters = self._regex = self._argument_weights = None
+
+
+MatchCacheInfo = namedtuple('MatchCacheInfo',
+                            ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class MatchCache(object):
+
+    """A size bounded LRU cache for the ``(rule, values)`` results of
+    :meth:`MapAdapter.match`.  The least recently used entry is dropped
+    once `maxsize` entries are stored.  It's cleared by :meth:`Map.add`
+    so changes to the rules are always seen.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                rv = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return rv
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        """Returns the statistics as :class:`MatchCacheInfo`."""
+        with self._lock:
+            return MatchCacheInfo(self.hits, self.misses, self.maxsize,
+                                  len(self._entries))
+
+
+class MapAdapter(object):
+
+    """Returned by :meth:`Map.bind` or :meth:`Map.bind_to_environ` and does
+    the URL matching and building based on runtime information.
+    """
+
+    def __init__(self, map, server_name, script_name, subdomain,
+                 url_scheme, path_info, default_method, query_args=None):
+        self.map = map
+        self.server_name = to_unicode(server_name)
+        script_name = to_unicode(script_name)
+        if not script_name.endswith(u'/'):
+            script_name += u'/'
+        self.script_name = script_name
+        self.subdomain = to_unicode(subdomain)
+        self.url_scheme = to_unicode(url_scheme)
+        self.path_info = to_unicode(path_info)
+        self.default_method = to_unicode(default_method)
+        self.query_args = query_args
+
+    def rebind(self, path_info, default_method, query_args=None):
+        """Returns a copy of this adapter for another request to the same
+        host.  Server name, script name, subdomain and URL scheme are taken
+        over as they are, only the path, the method and the query arguments
+        are replaced.  This is a lot cheaper than parsing the environment
+        again with :meth:`Map.bind_to_environ`.
+        """
+        rv = object.__new__(self.__class__)
+        rv.__dict__.update(self.__dict__)
+        rv.path_info = to_unicode(path_info)
+        rv.default_method = to_unicode(default_method)
+        rv.query_args = query_args
+        return rv
+
+    def match(self, path_info=None, method=None, return_rule=False,
+              query_args=None):
+        """The usage is simple: you just pass the match method the current
+        path info as well as the method (which defaults to `GET`).  If the
+        path matches a rule the endpoint (or the rule itself if `return_rule`
+        is set) and the converted values are returned.  Otherwise a
+        :exc:`NotFound`, :exc:`MethodNotAllowed` or :exc:`RequestRedirect`
+        is raised.
+
+        Rules without converters are looked up in a hash table first, so
+        a static path costs one dict lookup and a ``methods`` check.
+        If the map was created with ``radix_matching=True`` only the rules
+        the :class:`RadixMatcher` returns for the path are tried.  They are
+        tried in the same order as in the flat rule list, so the result is
+        the same as for ordered matching.
+
+        If the map has a match cache (``match_cache_size``) successful
+        matches are cached by server name, script name, path and method.
+        """
+        self.map.update()
+        if path_info is None:
+            path_info = self.path_info
+        else:
+            path_info = to_unicode(path_info, self.map.charset)
+        if query_args is None:
+            query_args = self.query_args
+        method = (method or self.default_method).upper()
+
+        # 只缓存匹配成功的结果，重定向和 404/405 每次都重新计算
+        cache = self.map._match_cache
+        if cache is None:
+            rule, rv = self._match(path_info, method, query_args)
+        else:
+            key = (self.server_name, self.subdomain, self.script_name,
+                   path_info, method)
+            cached = cache.get(key)
+            if cached is None:
+                rule, rv = self._match(path_info, method, query_args)
+                cache.set(key, (rule, rv))
+            else:
+                rule, rv = cached
+            # the caller owns the returned dict and may modify it
+            rv = dict(rv)
+
+        if return_rule:
+            return rule, rv
+        return rule.endpoint, rv
+
+    def _match(self, path_info, method, query_args):
+        """Does the actual matching for :meth:`match` and returns the
+        ``(rule, values)`` tuple or raises the routing exception.
+        """
+        domain = self.map.host_matching and self.server_name or self.subdomain
+        path = u'%s|%s' % (domain,
+                           path_info and '/%s' % path_info.lstrip('/'))
+
+        # 静态规则（没有转换器）直接查哈希表，方法不匹配时再走完整的匹配流程
+        static_rules = self.map._static_rules.get(
+            (domain or u'', path_info and '/%s' % path_info.lstrip('/')))
+        if static_rules is not None:
+            for rule in static_rules:
+                if rule.methods is None or method in rule.methods:
+                    rv = {}
+                    if self.map.redirect_defaults:
+                        redirect_url = self.get_default_redirect(
+                            rule, method, rv, query_args)
+                        if redirect_url is not None:
+                            raise RequestRedirect(redirect_url)
+                    return rule, rv
+
+        rules = self.map._rules
+        if self.map._matcher is not None:
+            rules = self.map._matcher.candidates(path_info)
+
+        have_match_for = set()
+        for rule in rules:
+            try:
+                rv = rule.match(path, method)
+            except RequestSlash:
+                raise RequestRedirect(self.make_redirect_url(
+                    url_quote(path_info, self.map.charset,
+                              safe='/:|+') + '/', query_args))
+            except RequestAliasRedirect as e:
+                raise RequestRedirect(self.make_alias_redirect_url(
+                    path, rule.endpoint, e.matched_values, method, query_args))
+            if rv is None:
+                continue
+            if rule.methods is not None and method not in rule.methods:
+                have_match_for.update(rule.methods)
+                continue
+
+            if self.map.redirect_defaults:
+                redirect_url = self.get_default_redirect(rule, method, rv,
+                                                         query_args)
+                if redirect_url is not None:
+                    raise RequestRedirect(redirect_url)
+
+            if rule.redirect_to is not None:
+                if isinstance(rule.redirect_to, string_types):
+                    def _handle_match(match):
+                        value = rv[match.group(1)]
+                        return rule._converters[match.group(1)].to_url(value)
+                    redirect_url = _simple_rule_re.sub(_handle_match,
+                                                       rule.redirect_to)
+                else:
+                    redirect_url = rule.redirect_to(self, **rv)
+                raise RequestRedirect(str(url_join('%s://%s%s%s' % (
+                    self.url_scheme or 'http',
+                    self.subdomain and self.subdomain + '.' or '',
+                    self.server_name,
+                    self.script_name
+                ), redirect_url)))
+
+            return rule, rv
+
+        if have_match_for:
+            raise MethodNotAllowed(valid_methods=list(have_match_for))
+        raise NotFound()
+
+
+# 只由这些成分组成的正则不可能匹配斜杠：[^/]、只含字母数字的字符类、
+# \d \w 和转义的 . -、普通字母数字以及分组和量词
+_slash_free_regex_re = re.compile(r"""
+    ^(?:
+        \[\^/\]
+      | \[[A-Za-z0-9_\-]*\]
+      | \\[dw.\-]
+      | [A-Za-z0-9_{},()?:+*|\-]
+    )*$
+""", re.VERBOSE)
+
+
+def _is_part_isolating(converter):
+    """Tells if the values of a converter stay inside one path segment.
+    Converters like the ``path`` converter can eat slashes and have to be
+    tried against the rest of the path instead of a single segment.
+
+    Converters can say so with a `part_isolating` attribute.  Otherwise
+    only a regex that provably can't match a slash, like the ones of the
+    built-in converters, counts as isolating.
+    """
+    rv = getattr(converter, 'part_isolating', None)
+    if rv is not None:
+        return rv
+    return _slash_free_regex_re.match(converter.regex) is not None
+
+
+class _RadixNode(object):
+    __slots__ = ('static', 'dynamic', 'rules', 'tail_rules')
+
+    def __init__(self):
+        #: literal segment -> child node
+        self.static = {}
+        #: list of ``(segment_regex, child)``.  Rules using the same
+        #: converters in a segment share the node.
+        self.dynamic = []
+        #: indexes of the rules that end at this node
+        self.rules = []
+        #: indexes of the rules whose remaining path starts with a
+        #: converter that can match slashes
+        self.tail_rules = []
+
+    def dynamic_child(self, pattern):
+        for regex, child in self.dynamic:
+            if regex.pattern == pattern:
+                return child
+        child = _RadixNode()
+        self.dynamic.append((re.compile(pattern, re.UNICODE), child))
+        return child
+
+
+class RadixMatcher(object):
+
+    """Compiles the rules of a :class:`Map` into a tree of path segments.
+    Static segments are looked up in a dict, segments with converters are
+    stored as nodes typed by the regular expression of the converters, so
+    finding the rules for a path costs a walk over the path segments and
+    not a regex match for every rule in the map.
+
+    The tree only selects candidates.  The final match is still done by
+    :meth:`Rule.match` in the original rule order, so strict slashes
+    redirects, host and subdomain matching, converter validation and
+    ``methods`` handling behave exactly like ordered matching.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.root = _RadixNode()
+        for index, rule in enumerate(self.rules):
+            if not rule.build_only:
+                self._insert(index, rule)
+
+    def _segments(self, rule):
+        """Splits the rule string into segments.  Every segment is a list
+        of ``(converter, text)`` tuples where `converter` is `None` for
+        static text.
+        """
+        segments = [[]]
+        for converter, arguments, variable in parse_rule(rule.rule):
+            if converter is None:
+                parts = variable.split('/')
+                segments[-1].append((None, parts[0]))
+                for part in parts[1:]:
+                    segments.append([(None, part)])
+            else:
+                segments[-1].append((rule._converters[variable], variable))
+        # the rule string starts with a slash, drop the empty first segment
+        return segments[1:]
+
+    def _insert(self, index, rule):
+        node = self.root
+        segments = self._segments(rule)
+        for offset, parts in enumerate(segments):
+            if all(conv is None for conv, text in parts):
+                text = u''.join(text for conv, text in parts)
+                child = node.static.get(text)
+                if child is None:
+                    child = node.static[text] = _RadixNode()
+            elif all(conv is None or _is_part_isolating(conv)
+                     for conv, text in parts):
+                pattern = u''.join(
+                    re.escape(text) if conv is None else
+                    u'(?:%s)' % conv.regex for conv, text in parts)
+                child = node.dynamic_child(u'^%s$' % pattern)
+            else:
+                node.tail_rules.append(index)
+                return
+            # 非叶子规则（以 / 结尾）在没有结尾斜杠的路径上也要作为候选，
+            # 由 Rule.match 决定是匹配还是抛出 RequestSlash 重定向
+            if offset == len(segments) - 2 and not rule.is_leaf:
+                child.rules.append(index)
+            node = child
+        node.rules.append(index)
+        # 非严格的叶子规则也匹配带结尾斜杠的路径，即多出一个空段
+        if rule.is_leaf and not rule.strict_slashes:
+            child = node.static.get(u'')
+            if child is None:
+                child = node.static[u''] = _RadixNode()
+            child.rules.append(index)
+
+    def _collect(self, node, segments, pos, found):
+        if node.tail_rules:
+            found.update(node.tail_rules)
+        if pos == len(segments):
+            found.update(node.rules)
+            return
+        segment = segments[pos]
+        child = node.static.get(segment)
+        if child is not None:
+            self._collect(child, segments, pos + 1, found)
+        for regex, child in node.dynamic:
+            if regex.match(segment) is not None:
+                self._collect(child, segments, pos + 1, found)
+
+    def candidates(self, path_info):
+        """Returns the rules that can match `path_info` in the order of
+        the rule list.
+        """
+        found = set()
+        self._collect(self.root, path_info.lstrip('/').split('/'), 0, found)
+        return [self.rules[index] for index in sorted(found)]
@@ -1,23 +1,1153 @@
 #!/usr/bin/python3
 # -*- coding=utf-8 -*-
+import os
+import selectors
+import signal
+import socket
+import stat
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import Condition, Lock, Thread
+
+from werkzeug.http import http_date
+from werkzeug.wsgi import SendfileWrapper, _RangeWrapper
+
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+
+
+class _StreamWriter(object):
+    """Collects the data a streamed response yields and writes it to the
+    socket in blocks of about `buffer_size` bytes instead of one write per
+    item.  With `chunked` set every block is sent as one chunk of the
+    chunked transfer encoding.  Writing an empty bytestring flushes what
+    was collected so far, so a view can yield ``b''`` to push data out
+    early.
+    """
+
+    def __init__(self, wfile, buffer_size):
+        self.wfile = wfile
+        self.buffer_size = buffer_size
+        self.chunked = False
+        self._pending = []
+        self._size = 0
+
+    def write(self, data):
+        if not data:
+            self.flush()
+            return
+        self._pending.append(data)
+        self._size += len(data)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self._size:
+            return
+        data = b''.join(self._pending)
+        del self._pending[:]
+        self._size = 0
+        if self.chunked:
+            data = b''.join((('%x\r\n' % len(data)).encode('ascii'),
+                             data, b'\r\n'))
+        # 一次系统调用写出整个块；客户端读得慢时这里阻塞，形成自然的背压
+        self.wfile.write(data)
+
+    def close(self):
+        self.flush()
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
 
 
 class WSGIRequestHandler(BaseHTTPRequestHandler, object):
-    
+
+    #: Enables the streaming mode if set to a number of bytes.  The items
+    #: the application yields are coalesced into writes of about this
+    #: size, and responses without a ``Content-Length`` use the chunked
+    #: transfer encoding on HTTP/1.1 connections.  Yielding an empty
+    #: bytestring flushes the buffer.  `None` writes every item as soon
+    #: as it's yielded.  The handler answers with HTTP/1.1 in this mode;
+    #: without :attr:`keep_alive_timeout` it still closes the connection
+    #: after each response.
+    stream_buffer_size = None
+
+    #: Enables HTTP/1.1 keep-alive if set to a number of seconds.  After a
+    #: response the connection waits this long for the next request
+    #: before it's closed.  Pipelined requests are handled one after
+    #: another.  `None` handles one request per connection.
+    keep_alive_timeout = None
+
+    #: The maximum number of requests served over one kept-alive
+    #: connection.  The last response carries ``Connection: close``.
+    max_keep_alive_requests = 100
+
+    #: If the application didn't read the whole request body, up to this
+    #: many bytes are read and discarded to keep the connection usable.
+    #: For larger bodies the connection is closed instead.
+    max_drain_size = 64 * 1024
+
+    #: The number of requests handled on this connection so far.
+    requests_handled = 0
+
+    def handle(self):
+        """Handles a request ignoring dropped connections."""
+        rv = None
+        try:
+            if self.keep_alive_timeout:
+                self.handle_keep_alive()
+            elif self.stream_buffer_size:
+                # 分块传输需要 HTTP/1.1；没有开启 keep-alive 时每个连接
+                # 仍然只处理一个请求
+                self.protocol_version = 'HTTP/1.1'
+                self.handle_one_request()
+            else:
+                rv = BaseHTTPRequestHandler.handle(self)
+        except (socket.error, socket.timeout) as e:
+            self.connection_dropped(e)
+        except Exception:
+            if self.server.ssl_context is None or not is_ssl_error():
+                raise
+        if self.server.shutdown_signal:
+            self.initiate_shutdown()
+        return rv
+
+    def handle_keep_alive(self):
+        """Handles requests on the connection until the client or the
+        application closes it, the connection is idle for
+        :attr:`keep_alive_timeout` seconds or
+        :attr:`max_keep_alive_requests` requests were served.
+        """
+        self.protocol_version = 'HTTP/1.1'
+        # 头和正文分两次写出，不关闭 Nagle 的话下一个请求要等延迟 ACK
+        try:
+            self.connection.setsockopt(socket.IPPROTO_TCP,
+                                       socket.TCP_NODELAY, 1)
+        except (socket.error, AttributeError):
+            pass
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            # 空闲等待下一个请求；流水线请求已经在 rfile 的缓冲区里，peek 会立即返回
+            self.connection.settimeout(self.keep_alive_timeout)
+            try:
+                if not self.rfile.peek(1):
+                    break
+            except socket.timeout:
+                break
+            self.connection.settimeout(self.timeout)
+            self.handle_one_request()
+
     def run_wsgi(self):
-        
+        if self.headers.get('Expect', '').lower().strip() == '100-continue':
+            self.wfile.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+
+        self.requests_handled += 1
+        self.environ = environ = self.make_environ()
+        environ['wsgi.file_wrapper'] = SendfileWrapper
+        if self.keep_alive_timeout:
+            self.limit_request_body(environ)
+        headers_set = []
+        headers_sent = []
+        stream = None
+        if self.stream_buffer_size:
+            stream = _StreamWriter(self.wfile, self.stream_buffer_size)
+
+        def write(data):
+            assert headers_set, 'write() before start_response'
+            if not headers_sent:
+                status, response_headers = headers_sent[:] = headers_set
+                try:
+                    code, msg = status.split(None, 1)
+                except ValueError:
+                    code, msg = status, ""
+                code = int(code)
+                self.send_response(code, msg)
+                header_keys = set()
+                for key, value in response_headers:
+                    self.send_header(key, value)
+                    key = key.lower()
+                    header_keys.add(key)
+                if self.keep_alive_timeout:
+                    close = bool(self.max_keep_alive_requests and
+                                 self.requests_handled >=
+                                 self.max_keep_alive_requests)
+                else:
+                    # HTTP/1.1 默认保持连接，不支持 keep-alive 时要明确告知
+                    close = self.protocol_version >= 'HTTP/1.1'
+                # 请求体没有可用的长度等情况下连接已经决定要关闭
+                close = close or self.close_connection
+                if 'content-length' in header_keys or \
+                        self.command == 'HEAD' or \
+                        code < 200 or code in (204, 304):
+                    # 这些响应没有正文，不需要长度也能保持连接
+                    pass
+                elif stream is not None and \
+                        self.can_send_chunked(code, header_keys):
+                    stream.chunked = True
+                    self.send_header('Transfer-Encoding', 'chunked')
+                else:
+                    close = True
+                if close:
+                    self.close_connection = True
+                    if 'connection' not in header_keys:
+                        self.send_header('Connection', 'close')
+                if 'server' not in header_keys:
+                    self.send_header('Server', self.version_string())
+                if 'date' not in header_keys:
+                    self.send_header('Date', self.date_time_string())
+                self.end_headers()
+
+            assert isinstance(data, bytes), 'applications must write bytes'
+            if stream is not None:
+                stream.write(data)
+            else:
+                self.wfile.write(data)
+                self.wfile.flush()
+
+        def start_response(status, response_headers, exc_info=None):
+            if exc_info:
+                try:
+                    if headers_sent:
+                        reraise(*exc_info)
+                finally:
+                    exc_info = None
+            elif headers_set:
+                raise AssertionError('Headers already set')
+            headers_set[:] = [status, response_headers]
+            return write
+
         def execute(app):
             application_iter = app(environ, start_response)
             try:
-                for data in application_iter:
-                    write(data)
+                source = self.get_sendfile_source(application_iter,
+                                                  headers_set)
+                if source is not None:
+                    write(b'')
+                    self.sendfile(*source)
+                else:
+                    for data in application_iter:
+                        write(data)
                 if not headers_sent:
                     write(b'')
+                if stream is not None:
+                    stream.close()
             finally:
                 if hasattr(application_iter, 'close'):
                     application_iter.close()
                 application_iter = None
 
+        try:
+            execute(self.server.app)
+        except (socket.error, socket.timeout) as e:
+            self.close_connection = True
+            self.connection_dropped(e, environ)
+        except Exception:
+            # 响应头已经发出时响应不完整，连接不能再用于下一个请求
+            if headers_sent:
+                self.close_connection = True
+            if self.server.passthrough_errors:
+                raise
+            from werkzeug.debug.tbtools import get_current_traceback
+            traceback = get_current_traceback(ignore_system_exceptions=True)
+            try:
+                # if we haven't yet sent the headers but they are set
+                # we roll back to be able to set them again.
+                if not headers_sent:
+                    del headers_set[:]
+                execute(InternalServerError())
+            except Exception:
+                pass
+            self.server.log('error', 'Error on request:\n%s',
+                            traceback.plaintext)
+
+        if self.keep_alive_timeout and not self.close_connection:
+            self.drain_request_body(environ)
+
+    def limit_request_body(self, environ):
+        """Wraps the input stream so the application can't read into the
+        next pipelined request and the unread rest of the body can be
+        skipped afterwards.  Bodies without a usable length end the
+        connection after the response.
+        """
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            self.close_connection = True
+            return
+        try:
+            length = max(0, int(self.headers.get('Content-Length') or 0))
+        except ValueError:
+            self.close_connection = True
+            length = 0
+        environ['wsgi.input'] = LimitedStream(self.rfile, length)
+
+    def drain_request_body(self, environ):
+        """Reads the part of the request body the application left, so
+        the next request on the connection starts at the right place.
+        """
+        stream = environ['wsgi.input']
+        if not isinstance(stream, LimitedStream) or stream.is_exhausted:
+            return
+        if stream.limit - stream._pos > self.max_drain_size:
+            self.close_connection = True
+            return
+        try:
+            stream.exhaust()
+        except (socket.error, socket.timeout, ClientDisconnected):
+            self.close_connection = True
+
+    def get_sendfile_source(self, application_iter, headers_set):
+        """Returns ``(file, offset, count)`` if the response body is a
+        regular file wrapped by :class:`~werkzeug.wsgi.SendfileWrapper`,
+        optionally cut down to a byte range, and can be sent with
+        ``os.sendfile``.  That needs a ``Content-Length`` and a connection
+        without SSL.  Returns `None` otherwise.
+        """
+        if not headers_set or self.server.ssl_context is not None or \
+                not hasattr(os, 'sendfile'):
+            return None
+        offset = None
+        if isinstance(application_iter, _RangeWrapper):
+            offset = application_iter.start_byte
+            application_iter = application_iter.iterable
+        if not isinstance(application_iter, SendfileWrapper):
+            return None
+        for key, value in headers_set[1]:
+            if key.lower() == 'content-length':
+                try:
+                    count = int(value)
+                except ValueError:
+                    return None
+                break
+        else:
+            return None
+        file = application_iter.file
+        try:
+            if not stat.S_ISREG(os.fstat(file.fileno()).st_mode):
+                return None
+            if offset is None:
+                offset = application_iter.tell()
+        except (AttributeError, ValueError, EnvironmentError):
+            return None
+        return file, offset, count
+
+    def sendfile(self, file, offset, count):
+        """Sends `count` bytes of `file` starting at `offset` straight
+        from the page cache to the socket.  If the file got shorter the
+        connection is closed, as the client waits for more data.
+        """
+        if count and self.connection.sendfile(file, offset, count) < count:
+            self.close_connection = True
+
+    def can_send_chunked(self, code, header_keys):
+        """Tells if a response without ``Content-Length`` can be sent with
+        the chunked transfer encoding instead of closing the connection.
+        """
+        return (self.request_version == 'HTTP/1.1' and
+                self.protocol_version >= 'HTTP/1.1' and
+                self.command != 'HEAD' and
+                code >= 200 and code not in (204, 304) and
+                'transfer-encoding' not in header_keys)
+
+
+
+class PooledWSGIServer(BaseWSGIServer):
+
+    """A threaded server with a fixed number of worker threads.  Accepted
+    connections wait in a queue of at most `queue_size` entries for a free
+    worker.  When the queue is full the connection is answered with
+    ``503 Service Unavailable`` right away instead of starting yet another
+    thread.  :meth:`pool_stats` reports the queue depth, the time
+    connections waited and how many were rejected.
+    """
+    multithread = True
+
+    def __init__(self, host, port, app, handler=None,
+                 passthrough_errors=False, ssl_context=None, fd=None,
+                 pool_size=16, queue_size=64):
+        BaseWSGIServer.__init__(self, host, port, app, handler,
+                                passthrough_errors, ssl_context, fd=fd)
+        self.pool_size = pool_size
+        self._queue = Queue(queue_size)
+        self._stats_lock = Lock()
+        self._handled = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._threads = []
+        for x in range(pool_size):
+            thread = Thread(target=self._worker,
+                            name='werkzeug-pool-%d' % x)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address, time.time()))
+        except Full:
+            # 队列已满直接拒绝，而不是无限制地创建线程
+            with self._stats_lock:
+                self._rejected += 1
+            self._reject(request)
+
+    def _reject(self, request):
+        try:
+            request.sendall(b'HTTP/1.0 503 Service Unavailable\r\n'
+                            b'Content-Type: text/plain\r\n'
+                            b'Content-Length: 20\r\n'
+                            b'Retry-After: 1\r\n'
+                            b'Connection: close\r\n\r\n'
+                            b'Server is too busy.\n')
+        except (socket.error, socket.timeout):
+            pass
+        self.shutdown_request(request)
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address, queued = item
+            wait = time.time() - queued
+            with self._stats_lock:
+                self._handled += 1
+                self._total_wait += wait
+                if wait > self._max_wait:
+                    self._max_wait = wait
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def pool_stats(self):
+        """Returns a dict with the current ``queue_depth``, the number of
+        ``handled`` and ``rejected`` connections and the ``avg_wait`` and
+        ``max_wait`` in seconds connections spent in the queue.
+        """
+        with self._stats_lock:
+            handled = self._handled
+            return {
+                'pool_size': self.pool_size,
+                'queue_depth': self._queue.qsize(),
+                'handled': handled,
+                'rejected': self._rejected,
+                'avg_wait': handled and self._total_wait / handled or 0.0,
+                'max_wait': self._max_wait,
+            }
+
+    def server_close(self):
+        for thread in self._threads:
+            self._queue.put(None)
+        BaseWSGIServer.server_close(self)
+
+
+class _EventLoopConnection(object):
+
+    """State of one client connection of :class:`EventLoopWSGIServer`."""
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.busy = False
+        self.continue_sent = False
+        self.close_after = False
+        self.events = 0
+        self.last_active = time.time()
+        # worker 线程已经交给事件循环、还没有放进 outbuf 的字节数
+        self.queued = 0
+        self.drained = Condition()
+
+
+class EventLoopWSGIServer(object):
+
+    """An event loop server on top of :mod:`selectors`.  The loop accepts
+    connections, reads and parses the requests and writes the responses
+    with non-blocking sockets.  Only complete requests are handed to a
+    pool of `workers` threads that run the application, so idle keep-alive
+    connections and slow clients cost a socket but no thread.
+
+    The worker passes the response to the loop chunk by chunk as the
+    application produces it, and waits while more than
+    `output_buffer_size` bytes of it aren't sent yet.  Large files and
+    endless streams therefore don't pile up in memory, but each streamed
+    response keeps its worker thread until it's done.  Request bodies
+    need a ``Content-Length`` (chunked uploads are answered with ``411``)
+    and may be at most `max_request_size` bytes.  SSL is not supported.
+    """
+    multithread = True
+    multiprocess = False
+    server_version = 'Werkzeug/evloop'
+    max_header_size = 64 * 1024
+    max_request_size = 16 * 1024 * 1024
+    output_buffer_size = 256 * 1024
+
+    def __init__(self, host, port, app, passthrough_errors=False, fd=None,
+                 workers=16, keep_alive_timeout=5):
+        if fd is not None:
+            sock = socket.fromfd(fd, select_ip_version(host, port),
+                                 socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(select_ip_version(host, port),
+                                 socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((host, port))
+            sock.listen(LISTEN_QUEUE)
+        sock.setblocking(False)
+        self.socket = sock
+        self.server_address = sock.getsockname()[:2]
+        self.host = host
+        self.port = self.server_address[1]
+        self.app = app
+        self.passthrough_errors = passthrough_errors
+        self.keep_alive_timeout = keep_alive_timeout
+        self.executor = ThreadPoolExecutor(workers)
+        self.selector = selectors.DefaultSelector()
+        self._connections = {}
+        # worker 线程把完成的响应放进队列，再通过 socketpair 唤醒事件循环
+        self._finished = deque()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._shutdown = False
+
+    def log(self, type, message, *args):
+        _log(type, message, *args)
+
+    def shutdown(self):
+        self._shutdown = True
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except (BlockingIOError, socket.error):
+            pass
+
+    def serve_forever(self):
+        self.selector.register(self.socket, selectors.EVENT_READ, None)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        try:
+            while not self._shutdown:
+                for key, mask in self.selector.select(timeout=1):
+                    if key.fileobj is self.socket:
+                        self._accept()
+                    elif key.fileobj is self._wakeup_r:
+                        self._drain_wakeup()
+                    else:
+                        conn = key.data
+                        if mask & selectors.EVENT_READ:
+                            self._read(conn)
+                        if mask & selectors.EVENT_WRITE and \
+                                conn.sock.fileno() != -1:
+                            self._write(conn)
+                self._process_finished()
+                self._close_idle()
+        finally:
+            self.server_close()
+
+    def server_close(self):
+        for conn in list(self._connections.values()):
+            self._close(conn)
+        self.executor.shutdown(wait=False)
+        self.selector.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+        self.socket.close()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, address = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except socket.error:
+                return
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = _EventLoopConnection(sock, address)
+            self._connections[sock.fileno()] = conn
+            self._update_events(conn)
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _close(self, conn):
+        if self._connections.pop(conn.sock.fileno(), None) is None:
+            return
+        if conn.events:
+            self.selector.unregister(conn.sock)
+            conn.events = 0
+        conn.sock.close()
+        # 唤醒还在等待发送的 worker，让它停止迭代响应
+        with conn.drained:
+            conn.drained.notify_all()
+
+    def _close_idle(self):
+        if not self.keep_alive_timeout:
+            return
+        deadline = time.time() - self.keep_alive_timeout
+        for conn in list(self._connections.values()):
+            if not conn.busy and not conn.outbuf and \
+                    conn.last_active < deadline:
+                self._close(conn)
+
+    def _update_events(self, conn):
+        # 处理请求期间不读取，流水线请求留在缓冲区里
+        events = 0
+        if not conn.busy:
+            events |= selectors.EVENT_READ
+        if conn.outbuf:
+            events |= selectors.EVENT_WRITE
+        if events == conn.events:
+            return
+        if not events:
+            self.selector.unregister(conn.sock)
+        elif not conn.events:
+            self.selector.register(conn.sock, events, conn)
+        else:
+            self.selector.modify(conn.sock, events, conn)
+        conn.events = events
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except socket.error:
+            data = b''
+        if not data:
+            self._close(conn)
+            return
+        conn.last_active = time.time()
+        conn.inbuf += data
+        self._dispatch(conn)
+
+    def _dispatch(self, conn):
+        """Starts the next request of the connection if it is complete.
+        Pipelined requests stay in the buffer until the response of the
+        current one is written.
+        """
+        if conn.busy or conn.close_after:
+            return
+        try:
+            request = self._parse_request(conn)
+        except _RequestError as e:
+            self._send_error(conn, e.args[0])
+            return
+        if request is None:
+            if len(conn.inbuf) > self.max_header_size and \
+                    conn.inbuf.find(b'\r\n\r\n') < 0:
+                self._send_error(conn, '431 Request Header Fields Too Large')
+            return
+        conn.busy = True
+        self._update_events(conn)
+        self.executor.submit(self._run_app, conn, request)
+
+    def _parse_request(self, conn):
+        end = conn.inbuf.find(b'\r\n\r\n')
+        if end < 0:
+            return None
+        lines = bytes(conn.inbuf[:end]).decode('latin1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise _RequestError('400 Bad Request')
+        if not version.startswith('HTTP/1.'):
+            raise _RequestError('505 HTTP Version Not Supported')
+        headers = []
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if not sep or not name or name != name.strip():
+                raise _RequestError('400 Bad Request')
+            headers.append((name.lower(), value.strip()))
+        header_dict = dict(headers)
+        if 'transfer-encoding' in header_dict:
+            raise _RequestError('411 Length Required')
+        try:
+            length = int(header_dict.get('content-length') or 0)
+        except ValueError:
+            raise _RequestError('400 Bad Request')
+        if length < 0:
+            raise _RequestError('400 Bad Request')
+        if length > self.max_request_size:
+            raise _RequestError('413 Request Entity Too Large')
+        body_start = end + 4
+        if len(conn.inbuf) < body_start + length:
+            if not conn.continue_sent and \
+                    header_dict.get('expect', '').lower() == '100-continue':
+                conn.continue_sent = True
+                self._send(conn, b'HTTP/1.1 100 Continue\r\n\r\n')
+            return None
+        body = bytes(conn.inbuf[body_start:body_start + length])
+        del conn.inbuf[:body_start + length]
+        conn.continue_sent = False
+        connection = header_dict.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            keep_alive = connection == 'keep-alive'
+        else:
+            keep_alive = connection != 'close'
+        return method, target, version, headers, body, keep_alive
+
+    def make_environ(self, conn, method, target, version, headers, body):
+        request_url = url_parse(target)
+        path_info = url_unquote(request_url.path)
+        environ = {
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'werkzeug.server.shutdown': self.shutdown,
+            'SERVER_SOFTWARE': self.server_version,
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': wsgi_encoding_dance(path_info),
+            'QUERY_STRING': wsgi_encoding_dance(request_url.query),
+            'REMOTE_ADDR': conn.address[0],
+            'REMOTE_PORT': conn.address[1],
+            'SERVER_NAME': self.server_address[0],
+            'SERVER_PORT': str(self.server_address[1]),
+            'SERVER_PROTOCOL': version,
+        }
+        for key, value in headers:
+            key = key.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+                if key in environ:
+                    value = environ[key] + ',' + value
+            environ[key] = value
+        if request_url.scheme and request_url.netloc:
+            environ['HTTP_HOST'] = request_url.netloc
+        return environ
+
+    def _run_app(self, conn, request):
+        """Runs in a worker thread.  Calls the application and passes the
+        response to the event loop as it's produced.  A list or tuple body
+        is sent in one piece with a ``Content-Length``, other iterables are
+        streamed, chunked if the application sets no length.
+        """
+        method, target, version, headers, body, keep_alive = request
+        environ = self.make_environ(conn, method, target, version,
+                                    headers, body)
+        status_set = []
+        # 状态行和头发出去之后保存 [code, chunked, keep_alive, 剩余长度]
+        head_sent = []
+
+        def start_response(status, response_headers, exc_info=None):
+            if exc_info:
+                try:
+                    if head_sent:
+                        reraise(*exc_info)
+                finally:
+                    exc_info = None
+            elif status_set:
+                raise AssertionError('Headers already set')
+            status_set[:] = [(status, response_headers)]
+            return write
+
+        def send_head(content_length=None):
+            if not status_set:
+                raise AssertionError('The application did not call '
+                                     'start_response')
+            status, response_headers = status_set[0]
+            code, head, chunked, alive = self._render_head(
+                method, version, status, response_headers, keep_alive,
+                content_length)
+            remaining = None
+            if method != 'HEAD' and code >= 200 and code not in (204, 304):
+                for key, value in response_headers:
+                    if key.lower() == 'content-length':
+                        try:
+                            remaining = int(value)
+                        except ValueError:
+                            pass
+            head_sent[:] = [code, chunked, alive, remaining]
+            return head
+
+        def write(data):
+            if head_sent and (not data or head_sent[3] == 0):
+                return
+            out = b'' if head_sent else send_head()
+            if data and method != 'HEAD':
+                if head_sent[1]:
+                    out += ('%x\r\n' % len(data)).encode('ascii') + \
+                        data + b'\r\n'
+                else:
+                    out += data
+            remaining = head_sent[3]
+            if remaining is not None:
+                # 声明的长度发完了响应就结束，不用再等一次 worker 的通知
+                remaining = head_sent[3] = max(0, remaining - len(data))
+            self._push(conn, out, remaining == 0, head_sent[2])
+
+        try:
+            app_iter = self.app(environ, start_response)
+            try:
+                if isinstance(app_iter, (list, tuple)) and not head_sent:
+                    payload = b''.join(app_iter)
+                    head = send_head(len(payload))
+                    if method != 'HEAD':
+                        head += payload
+                    head_sent[3] = 0
+                    self._push(conn, head, True, head_sent[2])
+                else:
+                    for data in app_iter:
+                        write(data)
+                    if not head_sent:
+                        write(b'')
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+            code, chunked, keep_alive, remaining = head_sent
+            if remaining != 0:
+                self._push(conn, b'0\r\n\r\n' if chunked else b'', True,
+                           keep_alive)
+        except _ConnectionGone:
+            return
+        except Exception:
+            if self.passthrough_errors:
+                self.shutdown()
+                raise
+            from werkzeug.debug.tbtools import get_current_traceback
+            traceback = get_current_traceback(ignore_system_exceptions=True)
+            self.log('error', 'Error on request:\n%s',
+                     traceback.plaintext)
+            if head_sent and head_sent[3] == 0:
+                # 响应已经完整交给事件循环，连接可能已经在处理下一个请求
+                code = head_sent[0]
+                data = None
+            elif head_sent:
+                # 响应已经发出一部分，只能关闭连接
+                code = head_sent[0]
+                data = b''
+            else:
+                # 出错之后不再信任这个连接上的状态，回完 500 就关闭
+                payload = InternalServerError().get_body(environ) \
+                    .encode('utf-8')
+                code, data, chunked, alive = self._render_head(
+                    method, version, '500 INTERNAL SERVER ERROR',
+                    [('Content-Type', 'text/html')], False, len(payload))
+                if method != 'HEAD':
+                    data += payload
+            if data is not None:
+                self._push(conn, data, True, False)
+        self.log('info', '%s - - [%s] "%s %s %s" %d -',
+                 conn.address[0], time.strftime('%d/%b/%Y %H:%M:%S'),
+                 method, target, version, code)
+
+    def _render_head(self, method, version, status, response_headers,
+                     keep_alive, content_length=None):
+        """Serializes the status line and the headers.  Returns the status
+        code, the bytes to send, whether the body is sent chunked and
+        whether the connection stays open.
+        """
+        code = int(status[:3])
+        out = ['HTTP/1.1 %s\r\n' % status]
+        header_keys = set()
+        for key, value in response_headers:
+            header_keys.add(key.lower())
+            out.append('%s: %s\r\n' % (key, value))
+        if 'server' not in header_keys:
+            out.append('Server: %s\r\n' % self.server_version)
+        if 'date' not in header_keys:
+            out.append('Date: %s\r\n' % http_date())
+        chunked = False
+        if 'content-length' in header_keys or code < 200 or \
+                code in (204, 304):
+            pass
+        elif method == 'HEAD':
+            keep_alive = False
+        elif content_length is not None:
+            out.append('Content-Length: %d\r\n' % content_length)
+        elif version == 'HTTP/1.1':
+            chunked = True
+            out.append('Transfer-Encoding: chunked\r\n')
+        else:
+            keep_alive = False
+        if not keep_alive:
+            out.append('Connection: close\r\n')
+        out.append('\r\n')
+        return code, ''.join(out).encode('latin1'), chunked, keep_alive
+
+    def _push(self, conn, data, done=False, keep_alive=False):
+        """Passes part of a response from a worker to the event loop.
+        Blocks while more than :attr:`output_buffer_size` bytes of the
+        connection aren't sent yet, and raises :exc:`_ConnectionGone` if
+        the connection was closed.
+        """
+        with conn.drained:
+            conn.queued += len(data)
+        self._finished.append((conn, data, done, keep_alive))
+        self._wakeup()
+        if done:
+            return
+        with conn.drained:
+            while conn.sock.fileno() != -1 and \
+                    conn.queued + len(conn.outbuf) > self.output_buffer_size:
+                conn.drained.wait()
+            if conn.sock.fileno() == -1:
+                raise _ConnectionGone()
+
+    def _process_finished(self):
+        while self._finished:
+            conn, data, done, keep_alive = self._finished.popleft()
+            with conn.drained:
+                conn.queued -= len(data)
+            if conn.sock.fileno() == -1:
+                continue
+            if done:
+                conn.close_after = not keep_alive
+                conn.busy = False
+            self._send(conn, data)
+
+    def _send_error(self, conn, status):
+        conn.close_after = True
+        self._send(conn, ('HTTP/1.1 %s\r\nContent-Length: 0\r\n'
+                          'Connection: close\r\n\r\n' % status)
+                   .encode('latin1'))
+
+    def _send(self, conn, data):
+        conn.outbuf += data
+        self._write(conn)
+
+    def _write(self, conn):
+        try:
+            sent = conn.sock.send(conn.outbuf)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except socket.error:
+            self._close(conn)
+            return
+        del conn.outbuf[:sent]
+        conn.last_active = time.time()
+        if sent and conn.busy:
+            with conn.drained:
+                conn.drained.notify_all()
+        if not conn.outbuf and conn.close_after:
+            self._close(conn)
+            return
+        # 发送缓冲区满了就等可写事件再继续
+        self._update_events(conn)
+        if not conn.outbuf and not conn.busy and conn.inbuf:
+            self._dispatch(conn)
+
+
+class _RequestError(Exception):
+    pass
+
+
+class _ConnectionGone(Exception):
+    pass
+
+
+def make_server(host=None, port=None, app=None, threaded=False, processes=1,
+                request_handler=None, passthrough_errors=False,
+                ssl_context=None, fd=None, pool_size=None,
+                pool_queue_size=None, server=None):
+    """Create a new server instance that is either threaded, or forks
+    or just processes one request after another.
+
+    If `threaded` is set together with `pool_size` a
+    :class:`PooledWSGIServer` with that many threads is used, and
+    `pool_queue_size` limits how many connections may wait for one.
+
+    With `server` set to ``'evloop'`` an :class:`EventLoopWSGIServer` is
+    returned that runs the application on `pool_size` worker threads.
+    """
+    if server == 'evloop':
+        if processes > 1:
+            raise ValueError('The evloop server cannot fork.')
+        if request_handler is not None or ssl_context is not None:
+            raise ValueError('The evloop server does not support a custom '
+                             'request handler or SSL.')
+        return EventLoopWSGIServer(host, port, app, passthrough_errors,
+                                   fd=fd, workers=pool_size or 16)
+    elif server is not None:
+        raise ValueError('Unknown server %r' % (server,))
+    if threaded and processes > 1:
+        raise ValueError("cannot have a multithreaded and "
+                         "multi process server.")
+    elif threaded and pool_size:
+        return PooledWSGIServer(host, port, app, request_handler,
+                                passthrough_errors, ssl_context, fd=fd,
+                                pool_size=pool_size,
+                                queue_size=pool_queue_size or pool_size * 4)
+    elif threaded:
+        return ThreadedWSGIServer(host, port, app, request_handler,
+                                  passthrough_errors, ssl_context, fd=fd)
+    elif processes > 1:
+        return ForkingWSGIServer(host, port, app, processes, request_handler,
+                                 passthrough_errors, ssl_context, fd=fd)
+    else:
+        return BaseWSGIServer(host, port, app, request_handler,
+                              passthrough_errors, ssl_context, fd=fd)
+
+
+def _reuseport_socket(host, port):
+    """Creates a listening socket bound with ``SO_REUSEPORT`` where the
+    platform has it, so a new master can bind the port while the old one
+    is still draining its workers.
+    """
+    address_family = select_ip_version(host, port)
+    sock = socket.socket(address_family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(LISTEN_QUEUE)
+    return sock
+
+
+class _PreforkWorkerServer(BaseWSGIServer):
+
+    """The server running in a worker of :class:`PreforkServer`.  It only
+    counts the handled requests so the worker can be recycled.
+    """
+    requests_handled = 0
+
+    def finish_request(self, request, client_address):
+        self.requests_handled += 1
+        BaseWSGIServer.finish_request(self, request, client_address)
+
+
+class PreforkServer(object):
+
+    """Pre-fork mode of the development server.  The master process binds
+    the address (with ``SO_REUSEPORT`` where available) and forks `workers`
+    processes that all accept from that socket, so the connections are
+    spread over the cores.  The accept queue belongs to the master, so
+    connections waiting in it are not lost when a worker is recycled.
+
+    The master restarts workers that exit.  A worker exits on its own after
+    `max_requests` requests so its memory is given back.  On ``SIGTERM`` or
+    ``SIGINT`` the master stops the workers; they finish the request they
+    are handling, and workers still running after `graceful_timeout`
+    seconds are killed.
+    """
+
+    def __init__(self, host, port, app, workers=2, handler=None,
+                 passthrough_errors=False, ssl_context=None,
+                 max_requests=None, graceful_timeout=30):
+        self.host = host
+        self.port = port
+        self.app = app
+        self.workers = workers
+        self.handler = handler
+        self.passthrough_errors = passthrough_errors
+        self.ssl_context = ssl_context
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.socket = None
+        self._children = {}
+        self._stopping = False
+
+    def log(self, type, message, *args):
+        _log(type, message, *args)
+
+    def serve_forever(self):
+        # 主进程绑定并监听，worker 继承同一个套接字并各自 accept
+        self.socket = _reuseport_socket(self.host, self.port)
+        self.port = self.socket.getsockname()[1]
+
+        def stop(signum, frame):
+            self._stopping = True
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        try:
+            while not self._stopping:
+                while len(self._children) < self.workers and \
+                        not self._stopping:
+                    self._spawn_worker()
+                self._reap_workers()
+                time.sleep(0.2)
+        finally:
+            self._stop_workers()
+            self.socket.close()
+
+    def _spawn_worker(self):
+        pid = os.fork()
+        if pid:
+            self._children[pid] = time.time()
+            return
+        status = 1
+        try:
+            self._run_worker()
+            status = 0
+        except Exception:
+            self.log('error', 'Worker %d failed', os.getpid())
+        finally:
+            os._exit(status)
+
+    def _run_worker(self):
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(1))
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        srv = _PreforkWorkerServer(self.host, self.port, self.app,
+                                   self.handler, self.passthrough_errors,
+                                   self.ssl_context, fd=self.socket.fileno())
+        # handle_request 每秒返回一次，以便检查 SIGTERM 标志。监听套接字
+        # 是所有 worker 共享的，没抢到连接的 worker 不能阻塞在 accept 里
+        srv.socket.setblocking(False)
+        srv.timeout = 1
+        while not stopping:
+            srv.handle_request()
+            if self.max_requests and \
+                    srv.requests_handled >= self.max_requests:
+                break
+        srv.server_close()
+
+    def _reap_workers(self):
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._children.clear()
+                return
+            if not pid:
+                return
+            started = self._children.pop(pid, None)
+            if started is None or self._stopping:
+                continue
+            if os.WIFSIGNALED(status) or os.WEXITSTATUS(status) != 0:
+                self.log('error', 'Worker %d died, restarting it', pid)
+                # 刚启动就崩溃的 worker 不要立刻重启，避免忙循环
+                if time.time() - started < 1:
+                    time.sleep(1)
+
+    def _stop_workers(self):
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                self._children.pop(pid, None)
+        deadline = time.time() + self.graceful_timeout
+        while self._children and time.time() < deadline:
+            self._reap_workers()
+            time.sleep(0.1)
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self._children.clear()
+
 
 
 def run_simple(hostname, port, application, use_reloader=False,
@@ -25,5 +1155,62 @@ def run_simple(hostname, port, application, use_reloader=False,
                extra_files=None, reloader_interval=1,
                reloader_type='auto', threaded=False,
                processes=1, request_handler=None, static_files=None,
-               passthrough_errors=False, ssl_context=None):
-    pass
+               passthrough_errors=False, ssl_context=None,
+               prefork=False, max_requests=None, pool_size=None,
+               pool_queue_size=None, server=None):
+    """Start a WSGI application.  Optional features include a reloader,
+    multithreading and fork support.
+
+    With `prefork` enabled a :class:`PreforkServer` starts `processes`
+    worker processes that share the port, restarts them when they die and
+    recycles them after `max_requests` requests.
+
+    With `threaded` and `pool_size` set the requests are handled by a
+    fixed pool of threads, see :class:`PooledWSGIServer`.
+
+    Passing ``server='evloop'`` uses the :class:`EventLoopWSGIServer`,
+    which keeps connections on a selector loop and only uses a thread of
+    its `pool_size` workers while the application runs.
+    """
+    if not isinstance(port, int):
+        raise TypeError('port must be an integer')
+    if use_debugger:
+        from werkzeug.debug import DebuggedApplication
+        application = DebuggedApplication(application, use_evalex)
+    if static_files:
+        from werkzeug.wsgi import SharedDataMiddleware
+        application = SharedDataMiddleware(application, static_files)
+
+    if prefork:
+        if use_reloader:
+            raise ValueError('The reloader cannot be used with the '
+                             'pre-fork mode.')
+        if threaded:
+            raise ValueError('The pre-fork mode cannot be combined with '
+                             'threaded.')
+        if server is not None:
+            raise ValueError('The pre-fork mode cannot be combined with '
+                             'the %r server.' % (server,))
+        PreforkServer(hostname, port, application, processes,
+                      request_handler, passthrough_errors, ssl_context,
+                      max_requests=max_requests).serve_forever()
+        return
+
+    def inner():
+        try:
+            fd = int(os.environ['WERKZEUG_SERVER_FD'])
+        except (LookupError, ValueError):
+            fd = None
+        srv = make_server(hostname, port, application, threaded,
+                          processes, request_handler,
+                          passthrough_errors, ssl_context,
+                          fd=fd, pool_size=pool_size,
+                          pool_queue_size=pool_queue_size, server=server)
+        srv.serve_forever()
+
+    if use_reloader:
+        from werkzeug._reloader import run_with_reloader
+        run_with_reloader(inner, extra_files, reloader_interval,
+                          reloader_type)
+    else:
+        inner()
@@ -3,7 +3,7 @@
 
 
 
-class cached_property(property):
+class cached_property(object):
 
     """A decorator that converts a function into a lazy property.  The
     function wrapped is called the first time to retrieve the result
@@ -18,14 +18,15 @@ class cached_property(property):
                 return 42
 
     The class has to have a `__dict__` in order for this property to
-    work.
+    work.  For classes with `__slots__` use :class:`cached_slot_property`.
     """
 
-    # implementation detail: A subclass of python's builtin property
-    # decorator, we override __get__ to check for a cached value. If one
-    # choses to invoke __get__ by hand the property will still work as
-    # expected because the lookup logic is replicated in __get__ for
-    # manual invocation.
+    # implementation detail: a non-data descriptor.  The value is stored
+    # in the instance `__dict__` under the same name, which takes
+    # precedence over the descriptor, so once it's computed reading it is
+    # a plain attribute lookup and `__get__` is not called anymore.
+    # Assigning or deleting the attribute works on the `__dict__` as
+    # usual.
 
     def __init__(self, func, name=None, doc=None):
         self.__name__ = name or func.__name__
@@ -33,9 +34,6 @@ class cached_property(property):
         self.__doc__ = doc or func.__doc__
         self.func = func
 
-    def __set__(self, obj, value):
-        obj.__dict__[self.__name__] = value
-
     def __get__(self, obj, type=None):
         if obj is None:
             return self
@@ -43,4 +41,58 @@ class cached_property(property):
         if value is _missing:
             value = self.func(obj)
             obj.__dict__[self.__name__] = value
-        return value
\ No newline at end of file
+        return value
+
+
+class cached_slot_property(object):
+
+    """A :class:`cached_property` for classes with `__slots__`.  The value
+    is stored in the slot named `slot` instead of the instance
+    `__dict__`, so the class doesn't need one::
+
+        class Foo(object):
+            __slots__ = ('_foo',)
+
+            @cached_slot_property('_foo')
+            def foo(self):
+                return 42
+    """
+
+    def __init__(self, slot, func=None, doc=None):
+        self.slot = slot
+        self.func = func
+        self.__doc__ = doc
+        self._member = None
+        if func is not None:
+            self(func)
+
+    def __call__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__module__ = func.__module__
+        self.__doc__ = self.__doc__ or func.__doc__
+        return self
+
+    def _get_member(self, type):
+        # 槽位的成员描述符，第一次访问时从类上取出
+        member = self._member
+        if member is None:
+            member = self._member = getattr(type, self.slot)
+        return member
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+        member = self._get_member(obj.__class__)
+        try:
+            return member.__get__(obj, type)
+        except AttributeError:
+            value = self.func(obj)
+            member.__set__(obj, value)
+            return value
+
+    def __set__(self, obj, value):
+        self._get_member(obj.__class__).__set__(obj, value)
+
+    def __delete__(self, obj):
+        self._get_member(obj.__class__).__delete__(obj)
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+# -*- coding=utf-8 -*-
+import mmap
+import os
+
+
+def wrap_file(environ, file, buffer_size=8192):
+    """Wraps a file.  This uses the WSGI server's file wrapper if available
+    or otherwise the :class:`SendfileWrapper`.
+
+    .. versionadded:: 0.5
+
+    If the file wrapper from the WSGI server is used it's important to not
+    iterate over it from inside the application but to pass it through
+    unchanged.  If you want to pass out a file wrapper inside a response
+    object you have to set :attr:`~BaseResponse.direct_passthrough` to `True`.
+
+    More information about file wrappers are available in :pep:`333`.
+
+    :param file: a :class:`file`-like object with a :meth:`~file.read` method.
+    :param buffer_size: number of bytes for one iteration.
+    """
+    return environ.get('wsgi.file_wrapper', SendfileWrapper)(file,
+                                                            buffer_size)
+
+
+class SendfileWrapper(FileWrapper):
+
+    """A :class:`FileWrapper` that exposes the :meth:`fileno` of the file,
+    so a server that recognises it can pass the file to ``os.sendfile``
+    instead of iterating over it.  The development server sets it as
+    ``wsgi.file_wrapper``.
+
+    When the wrapper is iterated anyway the chunks are sliced from a
+    read-only ``mmap`` of the file instead of calling ``read`` for each of
+    them.  Objects that can't be mapped, like pipes or in-memory files,
+    are read as usual.
+    """
+
+    def __init__(self, file, buffer_size=8192):
+        FileWrapper.__init__(self, file, buffer_size)
+        self._mmap = None
+        self._pos = 0
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def _get_mmap(self):
+        if self._mmap is None:
+            self._mmap = False
+            try:
+                fd = self.file.fileno()
+                # 空文件不能 mmap
+                if os.fstat(fd).st_size:
+                    self._pos = self.file.tell()
+                    self._mmap = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            except (AttributeError, ValueError, EnvironmentError):
+                pass
+        return self._mmap
+
+    def seek(self, *args):
+        FileWrapper.seek(self, *args)
+        if self._mmap:
+            self._pos = self.file.tell()
+
+    def tell(self):
+        if self._mmap:
+            return self._pos
+        return FileWrapper.tell(self)
+
+    def close(self):
+        if self._mmap:
+            self._mmap.close()
+        FileWrapper.close(self)
+
+    def __next__(self):
+        data = self._get_mmap()
+        if not data:
+            return FileWrapper.__next__(self)
+        data = data[self._pos:self._pos + self.buffer_size]
+        if data:
+            self._pos += len(data)
+            return data
+        raise StopIteration()